@@ -0,0 +1,166 @@
+'''
+Vectorized simulation of many Stack 'Em! games at once.
+
+BatchStackEm applies the rules of StackEm.tick to N games stored in
+NumPy arrays, e.g. for AI training and balance testing. Every game
+goes through the same floating point operations as a StackEm object,
+so its score, speed and positions match the scalar rules exactly.
+'''
+import numpy as np
+
+from stackem_engine import OSCILLATE_NEXT, OSCILLATE_STEPS, StackEm, oscillateSM
+
+# result codes of BatchStackEm.result, indexing StackEm.check_landing results
+RESULTS = (None,'lose','Bad..','Good','Great!')
+NONE, LOSE, BAD, GOOD, GREAT = range(5)
+
+
+class BatchStackEm:
+    '''
+    count independent games with the layout and timings of game_class.
+    Only the state the rules depend on is kept: the x of the top block,
+    the height of the tower on screen, the building block and the state
+    machines. As on screen, y is measured from the bottom of the view.
+    Other rules, such as the oscillator, tower_ticks and grade_landing
+    of PgStackEm, raise ValueError.
+    '''
+    steps = np.array(OSCILLATE_STEPS)
+    next_state = np.array(OSCILLATE_NEXT)
+
+    def __init__(self,count,game_class=StackEm):
+        if (game_class.tower_ticks != 1 or game_class.oscillator is not oscillateSM
+                or game_class.grade_landing is not StackEm.grade_landing
+                or not game_class.restart_block_oscillator):
+            raise ValueError('{} does not play by the rules of StackEm'.format(
+                game_class.__name__))
+        self.count = count
+        self.game_class = game_class
+        self.width,self.height_px = game_class.block_size
+        self.fall = game_class.drop_speed*game_class.tick_interval
+        self.ticks = 0
+
+        n = count
+        self.top_x = np.empty(n)
+        self.height = np.empty(n,dtype=np.int64)
+        self.next_x = np.empty(n)
+        self.next_y = np.empty(n)
+        self.tower_state = np.empty(n,dtype=np.int64)
+        self.block_state = np.empty(n,dtype=np.int64)
+        self.tower_coeff = np.empty(n)
+        self.block_coeff = np.empty(n)
+        self.score = np.empty(n,dtype=np.int64)
+        self.speed = np.empty(n)
+        self.drop = np.empty(n,dtype=bool)
+        self.lose = np.empty(n,dtype=bool)
+        self.result = np.zeros(n,dtype=np.int8)
+        self.restart()
+
+    def restart(self,mask=None):
+        '''
+        Resets the games in mask, or every game, like StackEm.restart.
+        '''
+        if mask is None:
+            mask = np.ones(self.count,dtype=bool)
+        g = self.game_class
+        self.top_x[mask] = g.base_pos[0]
+        self.height[mask] = 1
+        self.next_x[mask] = g.start_pos[0]
+        self.next_y[mask] = g.start_pos[1]
+        self.tower_state[mask] = 0
+        self.block_state[mask] = 0
+        self.tower_coeff[mask] = g.tower_coeff
+        self.block_coeff[mask] = g.block_coeff
+        self.score[mask] = 0
+        self.speed[mask] = 1.0
+        self.drop[mask] = False
+        self.lose[mask] = False
+
+    def press_space(self,mask):
+        '''
+        Starts dropping the building block of the games in mask
+        that are not lost or already dropping.
+        Returns the mask of games whose block started dropping.
+        '''
+        started = mask & ~self.lose & ~self.drop
+        self.drop |= started
+        return started
+
+    def tick(self):
+        '''
+        Advances every game by one tick, as StackEm.tick does.
+        Sets self.result to the landing result code of every game
+        and returns the mask of games whose block landed.
+        '''
+        self.ticks += 1
+
+        # move_tower: only the top block matters to the rules
+        self.top_x += self.tower_coeff*self.steps[self.tower_state]
+        self.tower_state = self.next_state[self.tower_state]
+
+        # move_block
+        if self.ticks % self.game_class.block_ticks == 0:
+            moving = ~self.drop
+            self.next_x += np.where(moving,self.block_coeff*self.steps[self.block_state],0.0)
+            self.block_state = np.where(moving,self.next_state[self.block_state],
+                                        self.block_state)
+
+        # drop_block
+        top_y = self.game_class.base_pos[1]+(self.height-1)*self.height_px
+        landing_y = top_y+self.height_px
+        above = self.drop & (self.next_y-self.fall > landing_y)
+        self.next_y -= np.where(above,self.fall,0.0)
+        landed = self.drop & ~above
+
+        self.result[:] = NONE
+        if landed.any():
+            self.check_landing(landed)
+
+        # check_tower: scrolling the view lowers the tower on screen by a block
+        g = self.game_class
+        self.height -= self.height >= (g.view_blocks or g.max_blocks)
+        return landed
+
+    def check_landing(self,landed):
+        '''
+        Applies StackEm.check_landing to the games in landed.
+        '''
+        x = self.next_x
+        top_x = self.top_x
+        w = self.width
+
+        fail = landed & ((x<top_x-w) | (x>top_x+w))
+        success = landed & ~fail
+        bad = success & ((x<top_x-0.5*w) | (x>top_x+0.5*w))
+        good = success & ~bad & ((x<top_x-0.1*w) | (x>top_x+0.1*w))
+        great = success & ~bad & ~good
+
+        self.result[fail] = LOSE
+        self.result[bad] = BAD
+        self.result[good] = GOOD
+        self.result[great] = GREAT
+        self.lose |= fail
+        self.score += success
+
+        # speed changes, in the same order of operations as StackEm
+        can_speed_up = self.tower_coeff<=14
+        faster = bad & can_speed_up
+        fast = good & can_speed_up
+        slower = great & (self.tower_coeff>2)
+        for mask,factor,change in ((faster,1.2,0.2),(fast,1.1,0.1)):
+            self.tower_coeff = np.where(mask,self.tower_coeff*factor,self.tower_coeff)
+            self.block_coeff = np.where(mask,self.block_coeff*factor,self.block_coeff)
+            self.speed = np.where(mask,self.speed+change,self.speed)
+        self.speed = np.where(slower,self.speed-0.1,self.speed)
+        self.tower_coeff = np.where(slower,self.tower_coeff*0.9,self.tower_coeff)
+        self.block_coeff = np.where(slower,self.block_coeff*0.9,self.block_coeff)
+
+        # the building block becomes the top of the tower
+        self.top_x = np.where(landed,x,top_x)
+        self.height += landed
+        self.drop &= ~landed
+
+        # new building block
+        g = self.game_class
+        self.next_x = np.where(landed,g.start_pos[0],x)
+        self.next_y = np.where(landed,g.start_pos[1],self.next_y)
+        self.block_state = np.where(landed,0,self.block_state)
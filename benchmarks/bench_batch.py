@@ -0,0 +1,82 @@
+'''
+Steps thousands of games at once with BatchStackEm and checks a few of
+them against StackEm objects given the same presses.
+
+Run from the repository root:
+    python benchmarks/bench_batch.py [games] [ticks]
+'''
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batch_sim import BatchStackEm
+from stackem_engine import OSCILLATE_STEPS, StackEm
+
+GAMES = 10000
+TICKS = 2000
+CHECKED = 50
+
+
+# sums of OSCILLATE_STEPS over two cycles, as in tournament.py
+PREFIX = np.concatenate(([0.0], np.cumsum(OSCILLATE_STEPS*2)))
+
+
+def aim(batch, tolerance):
+    '''
+    Returns the games whose block would land within tolerance (in
+    block widths, one per game) of the top of the tower if dropped now.
+    Different tolerances reach every kind of landing.
+    '''
+    landing_y = batch.game_class.base_pos[1]+batch.height*batch.height_px
+    ticks = np.ceil((batch.next_y-landing_y)/batch.fall).astype(np.int64)
+    state = batch.tower_state
+    shift = batch.tower_coeff*(PREFIX[state+ticks]-PREFIX[state])
+    return np.abs(batch.next_x-(batch.top_x+shift)) < tolerance*batch.width
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else GAMES
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else TICKS
+    tolerance = np.linspace(0.05, 1.2, games)
+    # spread the checked games over the whole range of tolerances
+    checked = np.unique(np.linspace(0, games-1, CHECKED).astype(np.int64))
+    presses = {i: set() for i in checked}
+
+    batch = BatchStackEm(games)
+    start = time.perf_counter()
+    for t in range(ticks):
+        started = batch.press_space(aim(batch, tolerance))
+        for i in checked[started[checked]]:
+            presses[i].add(t)
+        batch.tick()
+    elapsed = time.perf_counter()-start
+
+    # the same presses on StackEm must give bit-identical games
+    for i in checked:
+        game = StackEm()
+        for t in range(ticks):
+            if t in presses[i]:
+                assert game.press_space(), i
+            game.tick()
+        top = game.tower[-1]
+        assert (game.score, game.lose, len(game.tower)) == \
+            (batch.score[i], batch.lose[i], batch.height[i]), i
+        assert (game.speed, game.move_towerSM.coeff, game.move_blockSM.coeff) == \
+            (batch.speed[i], batch.tower_coeff[i], batch.block_coeff[i]), i
+        # BatchStackEm keeps the building block's y on screen
+        assert (game.top_x, game.next_block.x, game.next_block.y-game.scroll_y) == \
+            (batch.top_x[i], batch.next_x[i], batch.next_y[i]), i
+
+    print('games:        {:>14,}'.format(games))
+    print('ticks:        {:>14,}'.format(ticks))
+    print('lost:         {:>14,}'.format(int(batch.lose.sum())))
+    print('mean score:   {:>14.2f}'.format(batch.score.mean()))
+    print('game ticks/s: {:>14,.0f}'.format(games*ticks/elapsed))
+    print('checked against StackEm: {} games'.format(len(checked)))
+
+
+if __name__ == '__main__':
+    main()
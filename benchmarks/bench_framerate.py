@@ -0,0 +1,101 @@
+'''
+Plays the same presses with StackEm.step at different frame rates and
+counts the landings that happen in the tick the building block reaches
+the top of the tower, and how far the block went below the top of the
+tower before landing.
+
+Presses are only seen between frames, so at low frame rates they are
+late and the games differ, but no drop may land late or sink.
+
+Run from the repository root:
+    python benchmarks/bench_framerate.py [blocks]
+'''
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stackem_engine import StackEm
+from tournament import aim_bot
+
+BLOCKS = 200
+FRAME_RATES = (30, 60, 144)
+
+
+def press_ticks(blocks):
+    '''
+    Ticks at which aim_bot presses in a game of blocks blocks.
+    '''
+    game = StackEm()
+    while game.score < blocks and not game.lose:
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        game.tick()
+    return game.presses
+
+
+def impact_ticks(game):
+    '''
+    Ticks from now until the building block reaches the top of the tower.
+    '''
+    top = game.tower[-1]
+    fall = game.drop_speed*game.tick_interval
+    return -int(-(game.next_block.y-top.y-top.size[1])//fall)
+
+
+def play(presses, frame_times):
+    '''
+    Steps a game by frame_times, pressing once the game has reached each
+    tick of presses. Returns the number of landings, how many landed
+    after exactly impact_ticks, and the deepest the building block went
+    below the top of the tower.
+    '''
+    game = StackEm()
+    landings = [0, 0]
+    overshoot = [0]
+    expected = [None]
+    pending = list(presses)
+    tick = game.tick
+    def watched_tick():
+        result = tick()
+        top = game.tower[-1]
+        if game.drop:
+            overshoot[0] = max(overshoot[0], top.y+top.size[1]-game.next_block.y)
+        if result is not None:
+            landings[0] += 1
+            landings[1] += game.ticks == expected[0]
+        return result
+    # shadows the method like Profiler.instrument, to see every tick of a step
+    game.tick = watched_tick
+    frames = iter(frame_times)
+    while (pending or game.drop) and not game.lose:
+        # a press is only seen between frames, so it is late by up to a
+        # frame and the block is pressed elsewhere, but the drop itself
+        # must take the same ticks at any frame rate
+        if pending and game.ticks >= pending[0] and not game.drop:
+            pending.pop(0)
+            expected[0] = game.ticks+impact_ticks(game)
+            game.press_space()
+        game.step(next(frames))
+    return landings[0], landings[1], overshoot[0]
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else BLOCKS
+    presses = press_ticks(blocks)
+    rng = random.Random(0)
+
+    # one tick per frame, so that every press happens at its own tick
+    runs = [('1 tick', [StackEm.tick_interval]*10**7)]
+    runs += [('{} FPS'.format(fps), [1/fps]*10**7) for fps in FRAME_RATES]
+    runs.append(('ragged', [rng.choice((0.001, 0.007, 0.016, 0.033, 0.1))
+                            for i in range(10**7)]))
+
+    print('{:<10}{:>10}{:>14}{:>14}'.format('frames', 'landings', 'on impact', 'below tower'))
+    for name, frame_times in runs:
+        count, on_time, overshoot = play(presses, frame_times)
+        print('{:<10}{:>10}{:>14}{:>11.0f} px'.format(name, count, on_time, overshoot))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Compares how a SPACE press reaches the game with and without press
+times, at different frame rates, with the game stepped like the Kivy
+and pygame front ends do.
+
+Before, a press called StackEm.press_space() when it arrived, so the
+drop started at the tick of the last frame, up to a frame before the
+press. Now the front ends pass the time of the press into the frame to
+StackEm.step, so the drop starts from the press itself: right after the
+tick the press was in, as far into the fall as the rest of that tick.
+
+For every frame rate, presses arrive at random times between frames:
+    error    how far from the press the drop started, in game time
+    latency  time from the press to the end of the first frame that
+             shows the block falling
+    missed   taps of 20 to 120 ms that polling the key once a frame,
+             as pg_stackem.py did, never sees
+
+Run from the repository root:
+    python benchmarks/bench_input.py [presses]
+'''
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiler import DropLatency, Profiler
+from stackem_engine import StackEm
+
+PRESSES = 2000
+FRAME_RATES = (30, 60, 144)
+
+
+def press_once(fps, press, timed, profiler, latency):
+    '''
+    Plays frames of 1/fps seconds, the first after a random phase, with
+    one press at game time press. Records how far from the press the
+    drop started.
+    '''
+    game = StackEm()
+    frame = 1/fps
+    now = random.random()*frame
+    game.step(now)
+    pressed = False
+    while game.next_block.y == game.start_pos[1]:
+        # the press arrives while the last frame is shown
+        presses = [press] if not pressed and press <= now+frame else []
+        pressed = pressed or bool(presses)
+        latency.before(game, presses)
+        if presses and not timed:
+            game.press_space()
+        game.step(frame, [p-now for p in presses] if timed else ())
+        now += frame
+        latency.after(game, now)
+    # the drop started press_offsets[0] microseconds before the end of its tick
+    start = game.presses[0]*game.tick_interval-game.press_offsets[0]/1e6
+    profiler.add('error', int(abs(press-start)*1e9))
+
+
+def missed_taps(fps, count):
+    '''
+    Number of count taps that start at random times and last 20 to 120 ms,
+    of which none is held down at a poll every 1/fps seconds.
+    '''
+    frame = 1/fps
+    missed = 0
+    for i in range(count):
+        down = random.random()*frame
+        up = down+random.uniform(0.02, 0.12)
+        missed += up < frame
+    return missed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else PRESSES
+    random.seed(0)
+    print('{:>5} {:<8}{:>11}{:>11}{:>14}{:>14}{:>8}'.format(
+        'FPS', 'press', 'error p50', 'error max', 'latency p50', 'latency p95', 'missed'))
+    for fps in FRAME_RATES:
+        missed = missed_taps(fps, count)
+        for timed in (False, True):
+            profiler = Profiler(window=count)
+            latency = DropLatency(profiler)
+            for i in range(count):
+                press_once(fps, random.uniform(0.3, 0.5), timed, profiler, latency)
+            error = profiler.timers['error']
+            ms = [ns/1e6 for ns in error.percentiles((50,))+[error.max]]
+            ms += [ns/1e6 for ns in profiler.timers['input.latency'].percentiles((50, 95))]
+            print('{:>5} {:<8}{:>8.1f} ms{:>8.1f} ms{:>11.1f} ms{:>11.1f} ms{:>8}'.format(
+                fps, 'timed' if timed else 'frame', *ms,
+                0 if timed else '{:.0%}'.format(missed/count)))
+
+
+if __name__ == '__main__':
+    main()
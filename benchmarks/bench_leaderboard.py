@@ -0,0 +1,106 @@
+'''
+Benchmark of refreshing the leaderboard from synthetic highscore files.
+
+Loading reads the whole file into a HighscoreStore and selects the
+top 10. Refreshing reads only the APPENDED lines another process added
+afterwards. The original sort_highscores, which scans every name for
+every score, is timed as well for small files.
+
+Run from the repository root:
+    python benchmarks/bench_leaderboard.py
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from highscores import HEADER, HighscoreStore
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+# sort_highscores is O(N^2) and takes minutes at 10k entries,
+# so it is only timed up to this size
+LEGACY_LIMIT = 1000
+
+# lines appended by another store before the refresh is timed
+APPENDED = 100
+
+
+def write_highscores(path, count, seed=0):
+    '''
+    Writes a log of count players with scores from 0 to 99,
+    so there are many ties for the top 10.
+    '''
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for i in range(count):
+            f.write('player{},{}\n'.format(i, rng.randrange(100)))
+
+
+def legacy_sort_highscores(highscores):
+    '''
+    StartScreen.sort_highscores before HighscoreStore.top.
+    '''
+    sorted_scores = []
+    sorted_names = []
+    namelist = list(highscores.keys())
+    unsorted_scores = list(highscores.values())
+    sorted_scores = unsorted_scores[:]
+    sorted_scores.sort()
+    sorted_scores.reverse()
+
+    for score in sorted_scores:
+        for i,name in enumerate(namelist):
+            if score == unsorted_scores[i]:
+                if name not in sorted_names:
+                    sorted_names.append(name)
+    return sorted_names,sorted_scores
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter()-start
+
+
+def bench(count):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'highscores.txt')
+        write_highscores(path, count)
+        store, load_s = timed(HighscoreStore, path)
+        top, top_s = timed(store.top, 10)
+
+        # the ranking must match a full stable sort
+        assert top == sorted(store.scores.items(), key=lambda e: -e[1])[:10]
+
+        writer = HighscoreStore(path)
+        rng = random.Random(1)
+        for i in range(APPENDED):
+            writer.upsert('player{}'.format(rng.randrange(count)), 100+i)
+        changed, refresh_s = timed(store.refresh)
+        assert changed and store.top(10) == writer.top(10)
+
+        legacy_s = None
+        if count <= LEGACY_LIMIT:
+            reloaded = HighscoreStore(path)
+            (names, scores), legacy_s = timed(legacy_sort_highscores, reloaded.scores)
+            top = reloaded.top(10)
+            assert [name for name, score in top] == names[:10]
+    return load_s, top_s, refresh_s, legacy_s
+
+
+def main():
+    print('{:>9} {:>10} {:>10} {:>14} {:>14}'.format(
+        'entries', 'load (ms)', 'top (ms)', 'refresh (ms)', 'legacy (ms)'))
+    for count in SIZES:
+        load_s, top_s, refresh_s, legacy_s = bench(count)
+        legacy = '{:.1f}'.format(legacy_s*1000) if legacy_s is not None else '-'
+        print('{:>9} {:>10.1f} {:>10.3f} {:>14.3f} {:>14}'.format(
+            count, load_s*1000, top_s*1000, refresh_s*1000, legacy))
+
+
+if __name__ == '__main__':
+    main()
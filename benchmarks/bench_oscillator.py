@@ -0,0 +1,91 @@
+'''
+Micro-benchmark of oscillateSM.step against the original implementation,
+which called np.cos and built a new ['RIGHT', n] list every step.
+
+Run from the repository root:
+    python benchmarks/bench_oscillator.py
+'''
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stackem_engine import SM, oscillateSM
+
+
+class legacy_oscillateSM(SM):
+    '''
+    oscillateSM before the lookup table, kept as the reference.
+    '''
+    start_state = ['RIGHT',0]
+    coeff = 0
+
+    def get_next_values(self, state):
+        unit = np.pi/2/20
+        direction = state[0]
+        pos = state[1]
+        step = self.coeff*np.cos(unit*pos)
+        if direction == 'RIGHT':
+            output = step
+            if pos < 20:
+                ns = ['RIGHT', state[1]+1]
+            else:    # position is 20
+                ns = ['LEFT', state[1]-1]
+
+        elif direction == 'LEFT':
+            output = -step
+            if pos > -20:
+                ns = ['LEFT', state[1]-1]
+            else:     # position is -20
+                ns = ['RIGHT', state[1]+1]
+        return ns, output
+
+
+def trajectory(machine, steps):
+    '''
+    Returns the positions of a block moved by machine, changing
+    coeff the way check_landing does every 50 steps.
+    '''
+    machine.start()
+    machine.coeff = 4
+    x = 230
+    xs = []
+    for i in range(steps):
+        if i % 50 == 49:
+            machine.coeff *= (1.2, 1.1, 0.9)[i // 50 % 3]
+        x += machine.step()
+        xs.append(x)
+    return xs
+
+
+def check_identical(steps=10000):
+    '''
+    Asserts that both machines give bit-for-bit the same trajectory.
+    '''
+    new = trajectory(oscillateSM(), steps)
+    old = trajectory(legacy_oscillateSM(), steps)
+    for a, b in zip(new, old):
+        assert a.hex() == float(b).hex(), (a, b)
+
+
+def steps_per_second(machine, number=200000):
+    machine.start()
+    machine.coeff = 4
+    seconds = min(timeit.repeat(machine.step, number=number, repeat=5))
+    return number/seconds
+
+
+def main():
+    check_identical()
+    print('trajectories identical')
+    new = steps_per_second(oscillateSM())
+    old = steps_per_second(legacy_oscillateSM())
+    print('legacy oscillateSM: {:>12,.0f} steps/s'.format(old))
+    print('table oscillateSM:  {:>12,.0f} steps/s'.format(new))
+    print('speedup:            {:>12.1f}x'.format(new/old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+'''
+Compares the pygame main loop of pg_stackem.py before and after it drew
+over a cached background and updated only the changed rectangles.
+
+Drawing: the CPU time per frame of clearing the window, drawing the
+guide line and every block and updating the whole window, against
+updateGameWindow, for the same frames of a game played by aim_bot.
+
+Loop: the CPU used per frame and per second by the old loop, which
+waited pygame.time.delay(20) on top of every frame's work and stepped
+the game by 0.02s, against the main loop's wait for events until the
+next frame at FPS. delay spins the CPU for accuracy, the wait sleeps.
+
+Runs without a window with SDL's dummy video driver, where the display
+update itself is nearly free; on a real display the smaller updates
+save more.
+
+Run from the repository root:
+    python benchmarks/bench_pg.py [seconds]
+'''
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pygame
+from pg_stackem import (FPS, PgStackEm, block_rect, colours, makeBackground,
+                        waitForFrame)
+from tournament import aim_bot
+
+FRAMES = 3000
+SECONDS = 3
+
+
+def old_redraw(win, game):
+    '''
+    redrawGameWindow before it used a background and dirty rects.
+    '''
+    win.fill((0,0,0))
+    pygame.draw.line(win,(200,200,200),(0,80),(win.get_width(),80), 3)
+    pygame.draw.rect(win, colours[game.next_block.colour],
+                     block_rect(win, game.next_block, game.scroll_y))
+    for block in game.tower:
+        pygame.draw.rect(win, colours[block.colour],
+                         block_rect(win, block, game.scroll_y, game.tower_x))
+    pygame.display.update()
+
+
+def drawBlocks(win, game):
+    '''
+    Draws the tower and the building block and returns their rects.
+    '''
+    rects = []
+    for block in game.tower:
+        rects.append(block_rect(win, block, game.scroll_y, game.tower_x))
+        pygame.draw.rect(win, colours[block.colour], rects[-1])
+    rects.append(block_rect(win, game.next_block, game.scroll_y))
+    pygame.draw.rect(win, colours[game.next_block.colour], rects[-1])
+    return rects
+
+
+def redrawGameWindow(win, game, background):
+    '''
+    Redraws and updates the whole window, e.g. on the first frame.
+    '''
+    win.blit(background, (0,0))
+    rects = drawBlocks(win, game)
+    pygame.display.update()
+    return rects
+
+
+def updateGameWindow(win, game, background, drawn):
+    '''
+    The main loop's drawing before SpriteRenderer: moves the blocks
+    drawn last frame, the rects in drawn, to where game has them now.
+    Only the area under the old and new rects is restored from
+    background, redrawn and passed to display.update.
+    Returns the rects drawn.
+    '''
+    for rect in drawn:
+        win.blit(background, rect, rect)
+    rects = drawBlocks(win, game)
+    pygame.display.update(drawn+rects)
+    return rects
+
+
+def frames(count):
+    '''
+    Yields a game played by aim_bot after each of count ticks.
+    '''
+    game = PgStackEm()
+    for i in range(count):
+        if game.lose:
+            game = PgStackEm()
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        game.tick()
+        yield game
+
+
+def bench_drawing(win):
+    background = makeBackground(win)
+    start = time.process_time()
+    for game in frames(FRAMES):
+        old_redraw(win, game)
+    full = (time.process_time()-start)/FRAMES
+
+    drawn = redrawGameWindow(win, PgStackEm(), background)
+    area = 0
+    start = time.process_time()
+    for game in frames(FRAMES):
+        previous = drawn
+        drawn = updateGameWindow(win, game, background, drawn)
+        area += sum(r.w*r.h for r in previous+drawn)
+    dirty = (time.process_time()-start)/FRAMES
+
+    print('{:<12}{:>14}{:>16}'.format('drawing', 'CPU us/frame', 'updated px'))
+    print('{:<12}{:>14.1f}{:>16,}'.format('full', full*1e6, win.get_width()*win.get_height()))
+    print('{:<12}{:>14.1f}{:>16,.0f}'.format('dirty', dirty*1e6, area/FRAMES))
+
+
+def old_loop(win, seconds):
+    game = PgStackEm()
+    frame_count = ticks = 0
+    end = time.perf_counter()+seconds
+    while time.perf_counter() < end:
+        pygame.time.delay(20)
+        pygame.event.get()
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        game.step(0.02)
+        if game.lose:
+            ticks += game.ticks
+            game = PgStackEm()
+        old_redraw(win, game)
+        frame_count += 1
+    return frame_count, ticks+game.ticks
+
+
+def new_loop(win, seconds):
+    game = PgStackEm()
+    background = makeBackground(win)
+    drawn = redrawGameWindow(win, game, background)
+    frame_count = total = 0
+    end = time.perf_counter()+seconds
+    last = deadline = time.perf_counter()
+    while time.perf_counter() < end:
+        deadline = max(deadline+1/FPS, time.perf_counter())
+        waitForFrame(deadline, [])
+        now = time.perf_counter()
+        dt = now-last
+        last = now
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        ticks = game.ticks
+        game.step(dt)
+        if game.lose:
+            total += game.ticks
+            game = PgStackEm()
+            drawn = redrawGameWindow(win, game, background)
+        elif game.ticks != ticks:
+            drawn = updateGameWindow(win, game, background, drawn)
+        frame_count += 1
+    return frame_count, total+game.ticks
+
+
+def bench_loops(win, seconds):
+    print('{:<12}{:>10}{:>14}{:>14}{:>10}'.format('loop', 'frames/s', 'game speed',
+                                                  'CPU us/frame', 'CPU'))
+    for name, loop in (('delay(20)', old_loop), ('{} FPS'.format(FPS), new_loop)):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        frame_count, ticks = loop(win, seconds)
+        cpu = time.process_time()-cpu
+        wall = time.perf_counter()-wall
+        # game seconds per real second, 1.0 is full speed
+        speed = ticks*PgStackEm.tick_interval/wall
+        print('{:<12}{:>10.1f}{:>14.2f}{:>14.1f}{:>9.1%}'.format(
+            name, frame_count/wall, speed, cpu/frame_count*1e6, cpu/wall))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else SECONDS
+    pygame.init()
+    win = pygame.display.set_mode((500,650))
+    bench_drawing(win)
+    print()
+    bench_loops(win, seconds)
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Compares SpriteRenderer of pg_stackem.py with updateGameWindow of
+bench_pg.py, the renderer it replaced, with the tower cap of check_tower
+raised far above the 6 blocks of the game.
+
+updateGameWindow draws every block of the tower into its rect and
+updates the rects that changed. SpriteRenderer blits a landed block
+once into the tower sprite and moves one sprite per tick.
+
+For each cap, aim_bot plays until the tower has that many blocks, with
+the view scrolling every 6 blocks like the game. Both renderers then
+draw the same ticks of a copy of that game, and only the drawing is
+timed.
+
+Runs without a window with SDL's dummy video driver.
+
+Run from the repository root:
+    python benchmarks/bench_pg_render.py
+'''
+import copy
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pygame
+from bench_pg import redrawGameWindow, updateGameWindow
+from pg_stackem import PgStackEm, SpriteRenderer, makeBackground
+from tournament import aim_bot
+
+TOWER_CAPS = (6, 50, 200, 500, 2000)
+TICKS = 2000
+
+
+def play(game):
+    if not game.drop and aim_bot(game):
+        game.press_space()
+    game.tick()
+
+
+def tall_game(count):
+    '''
+    Returns a game played by aim_bot until its tower has count blocks.
+    '''
+    game = PgStackEm()
+    game.max_blocks = count+1
+    game.view_blocks = PgStackEm.max_blocks
+    while len(game.tower) < count:
+        play(game)
+        assert not game.lose
+    return game
+
+
+def bench_rects(win, background, game):
+    drawn = redrawGameWindow(win, game, background)
+    elapsed = 0
+    for i in range(TICKS):
+        play(game)
+        start = time.perf_counter_ns()
+        drawn = updateGameWindow(win, game, background, drawn)
+        elapsed += time.perf_counter_ns()-start
+    return elapsed/TICKS/1000
+
+
+def bench_sprites(win, background, game):
+    renderer = SpriteRenderer(win, game, background)
+    renderer.redraw()
+    elapsed = 0
+    for i in range(TICKS):
+        play(game)
+        start = time.perf_counter_ns()
+        renderer.draw()
+        elapsed += time.perf_counter_ns()-start
+    return elapsed/TICKS/1000
+
+
+def main():
+    pygame.init()
+    win = pygame.display.set_mode((500,650))
+    background = makeBackground(win)
+    print('{:>8}{:>16}{:>16}'.format('blocks', 'rects us/tick', 'sprites us/tick'))
+    for count in TOWER_CAPS:
+        game = tall_game(count)
+        rects = bench_rects(win, background, copy.deepcopy(game))
+        sprites = bench_sprites(win, background, copy.deepcopy(game))
+        print('{:>8}{:>16.1f}{:>16.1f}'.format(count, rects, sprites))
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Compares BlockRenderer and MeshRenderer of kv_stackem.py with the
+tower cap of check_tower raised far above the 5 blocks of the game.
+
+Each configuration runs for a number of frames in a Kivy window.
+Every frame moves the tower and the building block like the game does,
+and the time spent in the renderer and between frames is recorded.
+
+Run from the repository root (needs a display):
+    python benchmarks/bench_render.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kivy.config import Config
+# do not cap the frame rate, so that the frame time shows the drawing cost
+Config.set('graphics', 'maxfps', '0')
+Config.set('graphics', 'vsync', '0')
+
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.uix.widget import Widget
+
+from kv_stackem import BlockRenderer, MeshRenderer
+from stackem_engine import StackEm
+
+TOWER_CAPS = (5, 50, 200, 500)
+FRAMES = 300
+
+
+def stack_tower(game, count):
+    '''
+    Raises the tower cap of check_tower and stacks count blocks.
+    '''
+    game.max_blocks = count+1
+    while len(game.tower) < count:
+        top = game.tower[-1]
+        game.tower.append(game.new_block(top.x, top.y+top.size[1]))
+
+
+class RenderBenchmark(App):
+
+    def build(self):
+        self.configs = [(cap, renderer) for cap in TOWER_CAPS
+                        for renderer in (BlockRenderer, MeshRenderer)]
+        self.results = []
+        self.root_widget = Widget()
+        Clock.schedule_once(self.next_config, 0)
+        return self.root_widget
+
+    def next_config(self, dt):
+        if not self.configs:
+            self.report()
+            self.stop()
+            return
+        cap, renderer = self.configs.pop(0)
+        self.root_widget.canvas.clear()
+        self.game = StackEm()
+        stack_tower(self.game, cap)
+        self.renderer = renderer(self.root_widget.canvas, self.game)
+        self.config = (cap, renderer.__name__)
+        self.render_ns = 0
+        self.frames = 0
+        self.started = None
+        Clock.schedule_interval(self.frame, 0)
+
+    def frame(self, dt):
+        if self.started is None:
+            # skip the first frame, which uploads the buffers
+            self.started = time.perf_counter()
+            return
+        self.game.move_tower()
+        self.game.move_block()
+        start = time.perf_counter_ns()
+        self.renderer.move_tower()
+        self.renderer.move_block()
+        self.render_ns += time.perf_counter_ns()-start
+        self.frames += 1
+        if self.frames < FRAMES:
+            return
+        elapsed = time.perf_counter()-self.started
+        self.results.append(self.config + (self.render_ns/self.frames/1000,
+                                           elapsed/self.frames*1000))
+        Clock.schedule_once(self.next_config, 0)
+        return False
+
+    def report(self):
+        print('{:>6} {:>14} {:>16} {:>14}'.format('blocks', 'renderer',
+                                                 'update (us)', 'frame (ms)'))
+        for cap, name, update_us, frame_ms in self.results:
+            print('{:>6} {:>14} {:>16.1f} {:>14.2f}'.format(cap, name,
+                                                           update_us, frame_ms))
+
+
+if __name__ == '__main__':
+    RenderBenchmark().run()
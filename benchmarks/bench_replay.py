@@ -0,0 +1,91 @@
+'''
+Records a long game played by a bot, then times how long it takes to
+encode, decode and verify the replay without any window, and compares
+verifying with playing the replay back tick by tick.
+
+Run from the repository root:
+    python benchmarks/bench_replay.py [blocks]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from replay import Replay
+from stackem_engine import StackEm
+from tournament import aim_bot
+
+BLOCKS = 10000
+
+
+def record_game(blocks):
+    '''
+    Lets aim_bot play until blocks blocks have landed or it loses.
+    '''
+    game = StackEm()
+    while game.score < blocks and not game.lose:
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        game.tick()
+    return Replay.record(game)
+
+
+def play_every_tick(replay):
+    '''
+    Plays the replay back with one StackEm.tick call per tick, as
+    Replay.play did before StackEm.fast_forward.
+    '''
+    game = StackEm()
+    for name, value in replay.settings.items():
+        setattr(game, name, value)
+    game.colour_machine.state = replay.start_colour
+    game.restart()
+    for press, offset in zip(replay.presses, replay.offsets):
+        while game.ticks < press:
+            game.tick()
+        game.press_space(offset/1e6)
+    while game.ticks < replay.ticks:
+        game.tick()
+    return game
+
+
+def state(game):
+    return (game.score, game.presses, game.tower_x, game.top_x,
+            game.next_block.x, game.next_block.y, game.move_towerSM.coeff)
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else BLOCKS
+    start = time.perf_counter()
+    replay = record_game(blocks)
+    record_s = time.perf_counter()-start
+
+    start = time.perf_counter()
+    data = replay.to_bytes()
+    decoded = Replay.from_bytes(data)
+    codec_s = time.perf_counter()-start
+
+    start = time.perf_counter()
+    verified = decoded.verify()
+    verify_s = time.perf_counter()-start
+
+    start = time.perf_counter()
+    every_tick = play_every_tick(decoded)
+    every_tick_s = time.perf_counter()-start
+
+    print('score {}, {} ticks, {} presses'.format(replay.score, replay.ticks,
+                                                  len(replay.presses)))
+    print('replay size:     {:>10,} bytes'.format(len(data)))
+    print('recording (bot): {:>10.1f} ms'.format(record_s*1000))
+    print('encode + decode: {:>10.1f} ms'.format(codec_s*1000))
+    print('verify:          {:>10.1f} ms ({:,.0f} ticks/s)'.format(
+        verify_s*1000, replay.ticks/verify_s))
+    print('tick by tick:    {:>10.1f} ms ({:,.0f} ticks/s)'.format(
+        every_tick_s*1000, replay.ticks/every_tick_s))
+    assert verified, 'replay did not reproduce the game'
+    assert state(decoded.play()) == state(every_tick), \
+        'fast_forward did not match playing tick by tick'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''
+Compares how long the UI thread is blocked by the highscores with the
+HighscoreStore used directly, as StackEmApp did, and with a
+HighscoreWorker.
+
+For every size of log:
+    load     building the start screen: loading the log, or starting the
+             worker, and the time until the worker sent the leaderboard
+    save     one save_game of a new best score with its replay, p50 and
+             max, and the number of writes for a burst of SAVES saves
+
+Run from the repository root:
+    python benchmarks/bench_save.py
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_leaderboard import write_highscores
+from highscores import HighscoreStore, HighscoreWorker
+from replay import Replay, replay_path
+from stackem_engine import StackEm
+from tournament import aim_bot
+
+SIZES = (10000, 100000, 1000000)
+SAVES = 200
+
+
+def played_game(score):
+    game = StackEm()
+    while game.score < score:
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        game.tick()
+    return game
+
+
+def percentiles(times):
+    times = sorted(times)
+    return times[len(times)//2]*1000, times[-1]*1000
+
+
+def bench_store(path, replays, game):
+    start = time.perf_counter()
+    store = HighscoreStore(path)
+    store.top(10)
+    load = time.perf_counter()-start
+    times = []
+    for score in range(1000, 1000+SAVES):
+        start = time.perf_counter()
+        if store.upsert('player', score):
+            Replay.record(game).save(replay_path('player', replays))
+        times.append(time.perf_counter()-start)
+    return load*1000, None, percentiles(times), SAVES
+
+
+def bench_worker(path, replays, game):
+    boards = []
+    loaded = threading.Event()
+    def on_leaderboard(top):
+        boards.append(top)
+        loaded.set()
+    start = time.perf_counter()
+    worker = HighscoreWorker(path, on_leaderboard=on_leaderboard)
+    worker.start()
+    load = time.perf_counter()-start
+    loaded.wait()
+    ready = time.perf_counter()-start
+    times = []
+    for score in range(1000, 1000+SAVES):
+        start = time.perf_counter()
+        replay = Replay.record(game)
+        worker.save('player', score, lambda: replay.save(replay_path('player', replays)))
+        times.append(time.perf_counter()-start)
+    worker.close()
+    # one leaderboard after loading, then one per write
+    return load*1000, ready*1000, percentiles(times), len(boards)-1
+
+
+def main():
+    game = played_game(100)
+    print('{:>9}  {:<8}{:>10}{:>10}{:>11}{:>11}{:>8}'.format(
+        'players', 'using', 'load ms', 'ready ms', 'save p50', 'save max', 'writes'))
+    for count in SIZES:
+        for name, bench in (('store', bench_store), ('worker', bench_worker)):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'highscores.txt')
+                write_highscores(path, count)
+                load, ready, (p50, high), writes = bench(
+                    path, os.path.join(directory, 'replays'), game)
+            print('{:>9,}  {:<8}{:>10.1f}{:>10}{:>8.3f} ms{:>8.3f} ms{:>8}'.format(
+                count, name, load, '-' if ready is None else '{:.1f}'.format(ready),
+                p50, high, writes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Steps thousands of independent StackEm sessions in one process.
+
+Every session presses SPACE on its own schedule. The sessions are
+stepped round-robin, then a few are replayed on their own to check
+that no state leaked between them. Memory per session is measured
+with tracemalloc.
+
+Run from the repository root:
+    python benchmarks/bench_sessions.py [sessions] [ticks]
+'''
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from replay import Replay
+from stackem_engine import StackEm
+
+SESSIONS = 2000
+TICKS = 500
+
+
+def press_every(session):
+    '''
+    Number of ticks between presses of a session, so that
+    sessions land their blocks at different times.
+    '''
+    return 40+session % 37
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else SESSIONS
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else TICKS
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = [StackEm() for i in range(sessions)]
+    per_session = (tracemalloc.get_traced_memory()[0]-before)/sessions
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for t in range(ticks):
+        for i, game in enumerate(games):
+            if t % press_every(i) == 0:
+                game.press_space()
+            game.tick()
+    elapsed = time.perf_counter()-start
+
+    # the first sessions must play exactly as they do on their own
+    for i in range(min(sessions, 20)):
+        replay = Replay.record(games[i])
+        game = replay.play()
+        assert (game.score, game.lose, game.presses) == \
+            (games[i].score, games[i].lose, games[i].presses), i
+
+    print('sessions:          {:>12,}'.format(sessions))
+    print('memory per session:{:>12,.0f} bytes'.format(per_session))
+    print('session ticks/s:   {:>12,.0f}'.format(sessions*ticks/elapsed))
+
+
+if __name__ == '__main__':
+    main()
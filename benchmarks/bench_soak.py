@@ -0,0 +1,219 @@
+'''
+Soak test: simulates an hour of play and fails if memory or the number
+of drawing objects keeps growing.
+
+aim_bot plays game after game at 60 frames per second of game time, as
+fast as the machine allows, pressing 0 to JITTER ticks late like in
+tournament.py, or after PATIENCE ticks if aim_bot finds no moment to
+press. It hardly ever loses, so each game stops aiming at a random
+score of up to MAX_SCORE and is soon lost. Every lost game is
+saved like PlayScreen.save_game does. watchdog.MemoryWatch samples the memory
+traced by tracemalloc and the counters every minute of game time.
+
+The first WARMUP minutes set the envelope: afterwards memory may not
+rise more than MEMORY_SLACK above its peak so far, and no counter above
+its peak so far. Memory may also not grow by more than MEMORY_GROWTH
+bytes per minute after the warm-up, from the slope of its samples. A
+renderer that appends to its groups every frame leaves the envelope
+within minutes, and one that keeps something of every game within the
+hour.
+
+By default the game is drawn by pg_stackem's SpriteRenderer with SDL's
+dummy video driver, counting the sprites and colour surfaces. With
+--kivy it is drawn by kv_stackem's GameWidget, counting the
+instructions of the canvas and of every renderer group, which needs a
+display.
+
+Exits with status 1 if anything left the envelope.
+
+Run from the repository root:
+    python benchmarks/bench_soak.py [--minutes 60] [--kivy [--render-mode mesh]]
+'''
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from highscores import HighscoreStore
+from replay import Replay, replay_path
+from tournament import aim_bot
+from watchdog import MemoryWatch
+
+FPS = 60
+JITTER = 3
+MAX_SCORE = 100
+PATIENCE = 500
+WARMUP = 5
+MEMORY_SLACK = 256*1024
+MEMORY_GROWTH = 256
+
+
+class Soak:
+    '''
+    Plays minutes of game time one frame at a time with frame(), which
+    returns the game after the frame, and checks the envelope.
+    '''
+    def __init__(self, minutes, directory):
+        self.minutes = minutes
+        # the growth rate is over the samples after the warm-up
+        self.window = max(minutes-WARMUP, 2)
+        self.store = HighscoreStore(os.path.join(directory, 'highscores.txt'))
+        self.replays = os.path.join(directory, 'replays')
+        self.games = 0
+        self.best = 0
+        self.rng = random.Random(0)
+        self.press_at = None
+        self.pressed = 0
+        self.target = self.rng.randint(1, MAX_SCORE)
+
+    def press(self, game):
+        '''
+        Returns True when aim_bot, with its reaction jitter, presses SPACE,
+        or as soon as the block is built once the game reached its target.
+        '''
+        if game.drop:
+            return False
+        if game.score >= self.target or game.ticks-self.pressed > PATIENCE:
+            self.pressed = game.ticks
+            return True
+        if self.press_at is None and aim_bot(game):
+            self.press_at = game.ticks+self.rng.randint(0, JITTER)
+        if self.press_at is not None and game.ticks >= self.press_at:
+            self.press_at = None
+            self.pressed = game.ticks
+            return True
+        return False
+
+    def save(self, game):
+        self.press_at = None
+        self.pressed = 0
+        self.target = self.rng.randint(1, MAX_SCORE)
+        self.games += 1
+        self.best = max(self.best, game.score)
+        if self.store.upsert('soak', game.score):
+            Replay.record(game).save(replay_path('soak', self.replays))
+
+    def run(self, watch, frame):
+        '''
+        Returns the names that left the envelope.
+        '''
+        watch.start()
+        limits = None
+        start = time.perf_counter()
+        for minute in range(1, self.minutes+1):
+            for i in range(60*FPS):
+                frame()
+            watch.sample(minute*60)
+            if minute == WARMUP:
+                limits = dict(watch.peaks)
+                limits['memory'] += MEMORY_SLACK
+            print('{:>4} min  {:>9,.0f} bytes  {:>8.1f} s'.format(
+                minute, watch.last()['memory'], time.perf_counter()-start),
+                  flush=True)
+        watch.stop()
+        print(watch.text())
+        print('{} games, best score {}'.format(self.games, self.best))
+        if limits is None:
+            return []
+        outside = watch.outside(limits)
+        if watch.growth()['memory'] > MEMORY_GROWTH:
+            outside.append('memory growth')
+        return outside
+
+
+def soak_pygame(soak):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from pg_stackem import PgStackEm, SpriteRenderer, makeBackground
+    pygame.init()
+    win = pygame.display.set_mode((500,650))
+    background = makeBackground(win)
+    state = {}
+
+    def new_game():
+        if 'renderer' in state:
+            state['renderer'].close()
+        state['game'] = PgStackEm()
+        state['renderer'] = SpriteRenderer(win, state['game'], background)
+        state['renderer'].redraw()
+
+    def frame():
+        game = state['game']
+        if soak.press(game):
+            game.press_space()
+        game.step(1/FPS)
+        state['renderer'].draw()
+        if game.lose:
+            soak.save(game)
+            new_game()
+
+    new_game()
+    counters = {'tower': lambda: len(state['game'].tower),
+                'sprites': lambda: len(state['renderer'].group),
+                'images': lambda: len(state['renderer'].images)}
+    outside = soak.run(MemoryWatch(counters, soak.window), frame)
+    pygame.quit()
+    return outside
+
+
+def soak_kivy(soak, render_mode):
+    from kivy.app import App
+    from kivy.clock import Clock
+    from kv_stackem import GameWidget
+    result = []
+
+    class SoakApp(App):
+        def build(self):
+            GameWidget.render_mode = render_mode
+            self.widget = GameWidget()
+            Clock.schedule_once(self.soak, 0)
+            return self.widget
+
+        def frame(self):
+            widget = self.widget
+            game = widget.game
+            if soak.press(game):
+                game.press_space()
+            widget.update(1/FPS)
+            if game.lose:
+                soak.save(game)
+                widget.restart()
+                # restart() schedules the widget's own update, which
+                # would step the game in real time as well
+                widget.stop()
+
+        def soak(self, dt):
+            watch = MemoryWatch(self.widget.watch_counters(), soak.window)
+            result.extend(soak.run(watch, self.frame))
+            self.stop()
+
+    SoakApp().run()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate an hour of play.')
+    parser.add_argument('--minutes', type=int, default=60, help='minutes of game time')
+    parser.add_argument('--kivy', action='store_true',
+                        help='draw with the Kivy GameWidget (needs a display)')
+    parser.add_argument('--render-mode', default='blocks', choices=('blocks', 'mesh'),
+                        help='GameWidget.render_mode with --kivy')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        soak = Soak(args.minutes, directory)
+        if args.kivy:
+            outside = soak_kivy(soak, args.render_mode)
+        else:
+            outside = soak_pygame(soak)
+    if outside:
+        print('outside the envelope after {} minutes: {}'.format(WARMUP, ', '.join(outside)))
+        sys.exit(1)
+    print('within the envelope')
+
+
+if __name__ == '__main__':
+    main()
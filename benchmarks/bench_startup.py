@@ -0,0 +1,91 @@
+'''
+Measures the import cost of every module with python -X importtime,
+and whether importing it loads Kivy or opens the window.
+
+The game logic modules must not load Kivy at all, and importing
+kv_stackem must not open the window. The last row imports the window
+as well, which is what importing kv_stackem used to cost.
+
+With --frame, also times a fresh process from start to the first
+frame of StackEmApp, which needs a display.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [--frame]
+'''
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPEAT = 5
+
+# modules that must be importable without Kivy
+LOGIC = ('stackem_engine', 'highscores', 'replay', 'batch_sim', 'tournament',
+         'watchdog')
+
+CHECK = ("import sys; print('kivy' in sys.modules, "
+         "'kivy.core.window' in sys.modules)")
+
+FIRST_FRAME = '''
+from kivy.clock import Clock
+from kivy.core.window import Window
+from kv_stackem import StackEmApp
+Window.size = (500,600)
+app = StackEmApp()
+Clock.schedule_once(lambda dt: app.stop(), 0)
+app.run()
+'''
+
+
+def import_time(code, module):
+    '''
+    Runs code in a new interpreter with -X importtime.
+    Returns the cumulative import time of module in ms, the wall time
+    of the process in ms and the output of the process.
+    '''
+    env = dict(os.environ, KIVY_NO_CONSOLELOG='1', KIVY_NO_ARGS='1')
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=ROOT, env=env, capture_output=True, text=True,
+                          check=True)
+    wall = (time.perf_counter()-start)*1000
+    cumulative = 0
+    for line in done.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith('import time:') and line.split('|')[-1].strip() == module:
+            cumulative = int(line.split('|')[1])/1000
+    return cumulative, wall, done.stdout.split()
+
+
+def best(code, module):
+    runs = [import_time(code, module) for i in range(REPEAT)]
+    return min(r[0] for r in runs), min(r[1] for r in runs), runs[0][2]
+
+
+def main():
+    print('{:<30}{:>12}{:>12}{:>8}{:>8}'.format('import', 'import ms',
+                                              'process ms', 'kivy', 'window'))
+    rows = [(module, 'import {}; {}'.format(module, CHECK), module)
+            for module in LOGIC+('kv_stackem',)]
+    rows.append(('kv_stackem + window',
+                 'import kv_stackem, kivy.core.window; '+CHECK, 'kivy.core.window'))
+    for label, code, module in rows:
+        cumulative, wall, (kivy, window) = best(code, module)
+        print('{:<30}{:>12.1f}{:>12.1f}{:>8}{:>8}'.format(label, cumulative, wall,
+                                                        kivy, window))
+        if module in LOGIC:
+            assert kivy == 'False', module+' imports Kivy'
+        if module == 'kv_stackem':
+            assert window == 'False', 'importing kv_stackem opens the window'
+
+    if '--frame' in sys.argv:
+        env = dict(os.environ, KIVY_NO_CONSOLELOG='1', KIVY_NO_ARGS='1')
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', FIRST_FRAME], cwd=ROOT, env=env,
+                       check=True)
+        print('time to first frame: {:.0f} ms'.format((time.perf_counter()-start)*1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+'''
+Benchmark suite with stored baselines.
+
+Runs every case, compares it with benchmarks/baseline.json and exits
+with status 1 if any case is more than --threshold worse than its
+baseline. Each case is timed REPEAT times and the best run is kept,
+and a case that looks worse is run again up to --retries times, so a
+busy machine is less likely to cause a false regression. --save runs
+every case 1+retries times and stores the median, so a lucky run does
+not become the baseline. Runs on a shared machine still vary by about
+30%, hence the default threshold of 50%.
+
+Timings only compare on the same machine, so the baselines are not
+committed: --save stores them in benchmarks/baseline.json, which is
+ignored by git. Before every case, a fixed loop of Python code is
+timed as well, and the case is compared relative to it, so a machine
+that is slower or busier than when the baselines were saved slows
+the loop as much as the case.
+
+Cases:
+    oscillator       oscillateSM.step calls per second
+    landings         StackEm.check_landing calls per second
+    tower_<n>        StackEm.move_tower on a tower of n blocks, us per frame
+    render_<r>_<n>   renderer r updating the canvas for a tower of n blocks,
+                     us per frame (only with --render, needs a display)
+    highscores_<n>   loading a log of n players and selecting the top 10, ms
+    save_game        saving a highscore and its replay, ms
+
+Run from the repository root:
+    python benchmarks/run_benchmarks.py [--threshold 0.5] [--retries 2] [--save] [cases...]
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_leaderboard import write_highscores
+from highscores import HighscoreStore
+from replay import Replay, replay_path
+from stackem_engine import StackEm, oscillateSM
+from tournament import aim_bot
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+REPEAT = 5
+TOWER_SIZES = (5, 50, 500)
+HIGHSCORE_SIZES = (1000, 10000, 100000, 1000000)
+
+
+def best_time(function, number, repeat=REPEAT):
+    '''
+    Returns the shortest time in seconds of number calls to function.
+    '''
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate():
+    '''
+    Returns the best time in seconds of a fixed loop of arithmetic,
+    attribute and dict lookups, like the game code runs.
+    '''
+    table = {i: i*i for i in range(64)}
+    def loop():
+        total = 0
+        for i in range(100000):
+            total += table[i & 63] % 7
+    return best_time(loop, 1)
+
+
+def normalized(result):
+    '''
+    The value of a result in units of its calibration loop.
+    '''
+    if result['higher_is_better']:
+        return result['value']*result['calibration']
+    return result['value']/result['calibration']
+
+
+def scratch_directory():
+    '''
+    A temporary directory in memory where the system has one, so that
+    the highscore cases time the code rather than the disk and its fsync.
+    '''
+    memory = '/dev/shm'
+    return tempfile.TemporaryDirectory(dir=memory if os.path.isdir(memory) else None)
+
+
+def stack_tower(game, count):
+    '''
+    Raises the tower cap of check_tower and stacks count blocks.
+    '''
+    game.max_blocks = count+1
+    while len(game.tower) < count:
+        top = game.tower[-1]
+        game.tower.append(game.new_block(top.x, top.y+top.size[1]))
+
+
+def bench_oscillator():
+    machine = oscillateSM()
+    machine.start()
+    machine.coeff = 4
+    number = 200000
+    return number/best_time(machine.step, number)
+
+
+def bench_landings():
+    game = StackEm()
+    # a Great, Good and Bad landing in turn, so every branch is timed
+    offsets = (0, 10, 30)
+    number = 30000
+    def land():
+        for i in range(number):
+            game.next_block.x = game.top_x+offsets[i % 3]
+            game.check_landing()
+            game.check_tower()
+    return number/best_time(land, 1)
+
+
+def bench_tower(count):
+    game = StackEm()
+    stack_tower(game, count)
+    number = 1000
+    return best_time(game.move_tower, number)/number*1e6
+
+
+def bench_render(renderer_name, count):
+    # the renderers need the window's GL context
+    from kivy.core.window import Window
+    from kivy.uix.widget import Widget
+    from kv_stackem import BlockRenderer, MeshRenderer
+    renderer_class = {'blocks': BlockRenderer, 'mesh': MeshRenderer}[renderer_name]
+    game = StackEm()
+    stack_tower(game, count)
+    renderer = renderer_class(Widget().canvas, game)
+    def frame():
+        renderer.move_tower()
+        renderer.move_block()
+    number = 1000
+    return best_time(frame, number)/number*1e6
+
+
+def bench_highscores(count):
+    with scratch_directory() as directory:
+        path = os.path.join(directory, 'highscores.txt')
+        write_highscores(path, count)
+        return best_time(lambda: HighscoreStore(path).top(10), 1)*1000
+
+
+def bench_save_game():
+    '''
+    PlayScreen.save_game with a new best score every time, on a log of
+    10,000 players, for a game of 100 blocks played by aim_bot.
+    '''
+    game = StackEm()
+    while game.score < 100:
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        game.tick()
+    with scratch_directory() as directory:
+        path = os.path.join(directory, 'highscores.txt')
+        write_highscores(path, 10000)
+        store = HighscoreStore(path)
+        replays = os.path.join(directory, 'replays')
+        scores = iter(range(1000, 10**9))
+        def save_game():
+            if store.upsert('player', next(scores)):
+                Replay.record(game).save(replay_path('player', replays))
+        number = 50
+        return best_time(save_game, number)/number*1000
+
+
+def cases(render=False):
+    '''
+    Returns {name: (function, unit, higher_is_better)}.
+    '''
+    table = {'oscillator': (bench_oscillator, 'steps/s', True),
+             'landings': (bench_landings, 'landings/s', True)}
+    for count in TOWER_SIZES:
+        table['tower_{}'.format(count)] = (lambda c=count: bench_tower(c), 'us', False)
+    if render:
+        for name in ('blocks', 'mesh'):
+            for count in TOWER_SIZES:
+                table['render_{}_{}'.format(name, count)] = (
+                    lambda n=name, c=count: bench_render(n, c), 'us', False)
+    for count in HIGHSCORE_SIZES:
+        table['highscores_{}'.format(count)] = (
+            lambda c=count: bench_highscores(c), 'ms', False)
+    table['save_game'] = (bench_save_game, 'ms', False)
+    return table
+
+
+def regressed(value, baseline, higher_is_better, threshold):
+    if higher_is_better:
+        return value < baseline*(1-threshold)
+    return value > baseline*(1+threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite.')
+    parser.add_argument('cases', nargs='*', help='cases to run, default: all')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='fraction a case may be worse than its baseline')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='times a case that looks worse is run again')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baselines')
+    parser.add_argument('--render', action='store_true',
+                        help='also time the Kivy renderers (needs a display)')
+    args = parser.parse_args()
+
+    table = cases(args.render)
+    names = args.cases or list(table)
+    for name in names:
+        if name not in table:
+            parser.error('unknown case {!r}'.format(name))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    elif not args.save:
+        print('no baselines in {}: run with --save to store them'.format(args.baseline))
+
+    results = {}
+    failed = []
+    print('{:<20}{:>25}{:>25}{:>9}'.format('case', 'result', 'baseline', 'change'))
+    for name in names:
+        function, unit, higher_is_better = table[name]
+        baseline = baselines.get(name)
+        # a baseline saved without calibration compares plain values
+        score = normalized if baseline is None or 'calibration' in baseline else (
+            lambda result: result['value'])
+        attempts = []
+        for attempt in range(args.retries+1):
+            calibration = calibrate()
+            attempts.append({'value': function(), 'unit': unit,
+                             'higher_is_better': higher_is_better,
+                             'calibration': calibration})
+            attempts.sort(key=score, reverse=higher_is_better)
+            if not args.save and (baseline is None or not regressed(
+                    score(attempts[0]), score(baseline), higher_is_better, args.threshold)):
+                break
+        # a new baseline is a typical run, the check the best of its runs
+        result = attempts[len(attempts)//2] if args.save else attempts[0]
+        results[name] = result
+        value = result['value']
+        if baseline is None:
+            print('{:<20}{:>14,.1f} {:<10}{:>25}'.format(name, value, unit, '-'))
+            continue
+        change = score(result)/score(baseline)-1
+        status = ''
+        if regressed(score(result), score(baseline), higher_is_better, args.threshold):
+            failed.append(name)
+            status = '  REGRESSION'
+        print('{:<20}{:>14,.1f} {:<10}{:>14,.1f} {:<10}{:>+8.0%}{}'.format(
+            name, value, unit, baseline['value'], unit, change, status))
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print('baselines saved to {}'.format(args.baseline))
+    elif failed:
+        print('{} regressed by more than {:.0%}: {}'.format(
+            len(failed), args.threshold, ', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+'''
+Highscore storage for Stack 'Em!
+
+Scores are kept in an append-only log of 'name,score' lines.
+Saving a score appends a single line instead of rewriting the file,
+and the log is compacted into one line per name with an atomic
+rename once it has grown to twice the number of players.
+Other processes, e.g. tournament.py, may write the same log: appending
+and compacting hold an advisory lock on a sidecar '.lock' file.
+HighscoreWorker does the loading and saving on a background thread.
+'''
+import bisect
+import contextlib
+import heapq
+import locale
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks, e.g. on Windows: only one writer at a time
+    fcntl = None
+
+# first line of a log, which tells it apart from the old highscores.txt
+HEADER = '#stackem-highscores 1\n'
+
+
+class HighscoreStore:
+    '''
+    Append-only highscore log with an in-memory index of the best
+    score of every player, in the order the players first appeared.
+    The top_size best players are also kept sorted in self.leaderboard
+    as (-score, order, name), so the leaderboard is never re-sorted.
+    '''
+    # compact once the log has this many lines per player
+    compact_ratio = 2
+
+    # number of players kept in self.leaderboard
+    top_size = 10
+
+    def __init__(self,path='highscores.txt'):
+        self.path = path
+        # the open lock file while this store holds the lock
+        self.lock_file = None
+        self.load()
+
+    @contextlib.contextmanager
+    def locked(self):
+        '''
+        Holds the lock of the log against other processes and other
+        stores. A store that already holds it keeps it.
+        '''
+        if self.lock_file is not None:
+            yield
+            return
+        with open(self.path+'.lock','ab') as self.lock_file:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file.fileno(),fcntl.LOCK_EX)
+                yield
+            finally:
+                # closing the file releases the lock
+                self.lock_file = None
+
+    def load(self):
+        '''
+        Reads the whole log into self.scores.
+        A file without HEADER is in the old format, where every name
+        appears once with its latest score, and is migrated to a log.
+        The old format was written in the locale's encoding, the log
+        is UTF-8.
+        '''
+        with self.locked():
+            self.scores = {}
+            self.lines = 0
+            if not os.path.exists(self.path):
+                self.build_leaderboard()
+                self.compact()
+                return
+
+            with open(self.path,'rb') as f:
+                data = f.read()
+                self.inode = os.fstat(f.fileno()).st_ino
+            legacy = not data.startswith(HEADER.encode())
+            if legacy:
+                # as open(...,'a') wrote it in the old save_game; a name
+                # the locale cannot decode keeps its score under a U+FFFD
+                encoding,errors = locale.getpreferredencoding(False),'replace'
+            else:
+                encoding,errors = 'utf-8','strict'
+
+            # writers append under the lock, so a partial last line
+            # is left by a save interrupted by a crash
+            end = data.rfind(b'\n')+1
+            for name,score in self.parse_lines(data[:end],encoding,errors):
+                self.lines += 1
+                if legacy or score > self.scores.get(name,score-1):
+                    self.scores[name] = score
+            self.offset = end
+            self.build_leaderboard()
+
+            if legacy or end < len(data):
+                self.compact()
+
+    def refresh(self):
+        '''
+        Reads only the lines appended to the log since the last read,
+        e.g. by another process. The whole log is read again if it was
+        replaced by a compaction in the meantime.
+        A partial last line is left for the next read.
+        Returns True if any score changed.
+        '''
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.load()
+            return True
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.load()
+            return True
+        if stat.st_size == self.offset:
+            return False
+
+        with open(self.path,'rb') as f:
+            # a compaction may have replaced the log since the stat,
+            # and the old offset means nothing in the new file
+            replaced = os.fstat(f.fileno()).st_ino != self.inode
+            if not replaced:
+                f.seek(self.offset)
+                data = f.read()
+        if replaced:
+            self.load()
+            return True
+        end = data.rfind(b'\n')+1
+        self.offset += end
+
+        changed = False
+        for name,score in self.parse_lines(data[:end]):
+            self.lines += 1
+            if self.record(name,score):
+                changed = True
+        return changed
+
+    def parse_lines(self,data,encoding='utf-8',errors='strict'):
+        '''
+        Yields (name, score) for every 'name,score' line in data.
+        '''
+        for line in data.decode(encoding,errors).splitlines():
+            entry = self.parse(line)
+            if entry is not None:
+                yield entry
+
+    def parse(self,line):
+        '''
+        Returns (name, score) for a 'name,score' line, else None.
+        '''
+        if line.startswith('#'):
+            return None
+        name,_,score = line.rpartition(',')
+        try:
+            return name,int(score)
+        except ValueError:
+            return None
+
+    def build_leaderboard(self):
+        '''
+        Selects the top_size best players from self.scores.
+        '''
+        self.order = {name:i for i,name in enumerate(self.scores)}
+        self.leaderboard = heapq.nsmallest(self.top_size,
+                                           ((-score,self.order[name],name)
+                                            for name,score in self.scores.items()))
+
+    def record(self,name,score):
+        '''
+        Sets the best score of name in the index and the leaderboard.
+        A player's best score never goes down, so a player only moves up
+        the leaderboard and this costs O(top_size) instead of a re-sort.
+        Returns True if it is a new best score.
+        '''
+        previous = self.scores.get(name)
+        if previous is not None and previous >= score:
+            return False
+        if previous is None:
+            self.order[name] = len(self.order)
+        self.scores[name] = score
+
+        board = self.leaderboard
+        if previous is not None:
+            old = (-previous,self.order[name],name)
+            i = bisect.bisect_left(board,old)
+            if i < len(board) and board[i] == old:
+                del board[i]
+        new = (-score,self.order[name],name)
+        if len(board) < self.top_size or new < board[-1]:
+            bisect.insort(board,new)
+            del board[self.top_size:]
+        return True
+
+    def upsert(self,name,score):
+        '''
+        Records score for name if it beats the player's best score.
+        Returns True if the score was recorded.
+        '''
+        return bool(self.upsert_many([(name,score)]))
+
+    def upsert_many(self,entries):
+        '''
+        Records every (name, score) of entries that beats the player's
+        best score, and appends their lines in a single write.
+        The scores other writers appended are read first, so a score
+        only counts as recorded if it beats theirs as well.
+        Returns the recorded entries.
+        '''
+        with self.locked():
+            self.refresh()
+            if os.path.getsize(self.path) > self.offset:
+                # a writer crashed in the middle of a line
+                self.compact()
+
+            recorded = []
+            lines = []
+            for name,score in entries:
+                clean = name.replace('\n',' ')
+                if self.record(clean,score):
+                    recorded.append((name,score))
+                    lines.append('{},{}\n'.format(clean,score))
+            if not lines:
+                return recorded
+
+            data = ''.join(lines).encode('utf-8')
+            with open(self.path,'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # the log ended at self.offset, so our own lines are read
+            self.offset += len(data)
+            self.lines += len(lines)
+
+            if self.lines >= self.compact_ratio*len(self.scores):
+                self.compact()
+        return recorded
+
+    def compact(self):
+        '''
+        Rewrites the log with one line per player, including the
+        scores other writers appended since the last read.
+        The new log is written to a temporary file and renamed over
+        the old one, so a crash leaves either the old or the new log.
+        '''
+        with self.locked():
+            if os.path.exists(self.path):
+                self.refresh()
+            # unique, in case two writers compact without fcntl
+            temp_path = '{}.{}-{}.tmp'.format(self.path,os.getpid(),threading.get_ident())
+            with open(temp_path,'wb') as f:
+                f.write(HEADER.encode())
+                for name,score in self.scores.items():
+                    f.write('{},{}\n'.format(name,score).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+                self.offset = f.tell()
+            os.replace(temp_path,self.path)
+            self.inode = os.stat(self.path).st_ino
+            self.lines = len(self.scores)
+
+    def get(self,name):
+        return self.scores.get(name)
+
+    def top(self,k=10):
+        '''
+        Returns the k best (name, score) pairs in descending order of score.
+        Players with the same score are in the order they first appeared.
+        Up to top_size players come straight from self.leaderboard;
+        more are selected with heapq.nsmallest in O(N log k).
+        '''
+        if k <= self.top_size:
+            return [(name,-score) for score,order,name in self.leaderboard[:k]]
+        return heapq.nsmallest(k,self.scores.items(),key=lambda entry: -entry[1])
+
+    def __len__(self):
+        return len(self.scores)
+
+
+class HighscoreWorker:
+    '''
+    Loads a HighscoreStore and saves scores into it on a background
+    thread, so that a slow disk or a large log never stalls the caller.
+
+    Saves wait in a queue of up to max_pending players. A player's saves
+    are coalesced into the best of them, and all saves waiting when the
+    thread gets to them are written with one upsert_many.
+    save() never waits: a save of another player is dropped while
+    max_pending players are queued.
+
+    on_leaderboard(top) is called with the top_size best (name, score)
+    pairs once the log is loaded and whenever a save or refresh changed
+    them, and on_error(error) with any exception of the thread. Both are
+    called through schedule(function,*args), e.g. to run them on the UI
+    thread; by default they run on the worker thread. The thread runs
+    from start(). If the log cannot be loaded, self.error is set and
+    the worker stops.
+    '''
+    max_pending = 64
+
+    def __init__(self,path='highscores.txt',on_leaderboard=None,
+                 on_error=None,schedule=None,top_size=10):
+        self.path = path
+        self.on_leaderboard = on_leaderboard
+        self.on_error = on_error
+        self.schedule = schedule or (lambda function,*args: function(*args))
+        self.top_size = top_size
+        # set by the worker thread once the log is loaded,
+        # or the exception that kept it from loading
+        self.store = None
+        self.error = None
+        # name: (score, on_recorded) of the best save of each player
+        self.pending = {}
+        self.refreshing = False
+        self.closing = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run,name='highscores',daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def save(self,name,score,on_recorded=None):
+        '''
+        Queues score for name. If it beats the player's best score,
+        on_recorded() is called on the worker thread once it is written,
+        e.g. to write the replay of the game.
+        Returns False if the save was dropped: the queue is full, or the
+        worker is closed or failed to load the log.
+        '''
+        with self.condition:
+            if self.closing or self.error is not None:
+                return False
+            previous = self.pending.get(name)
+            if previous is None and len(self.pending) >= self.max_pending:
+                return False
+            if previous is None or score > previous[0]:
+                self.pending[name] = (score,on_recorded)
+            self.condition.notify_all()
+            return True
+
+    def refresh(self):
+        '''
+        Asks the worker to read the scores other processes appended.
+        '''
+        with self.condition:
+            self.refreshing = True
+            self.condition.notify_all()
+
+    def close(self):
+        '''
+        Writes the queued saves and stops the thread.
+        '''
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        try:
+            self.store = HighscoreStore(self.path)
+        except Exception as error:
+            with self.condition:
+                self.error = error
+                self.pending = {}
+            self.report(error)
+            return
+        self.publish()
+        while True:
+            with self.condition:
+                while not (self.pending or self.refreshing or self.closing):
+                    self.condition.wait()
+                pending,self.pending = self.pending,{}
+                refreshing,self.refreshing = self.refreshing,False
+                closing = self.closing
+            changed = False
+            recorded = []
+            try:
+                changed = refreshing and self.store.refresh()
+                if pending:
+                    recorded = self.store.upsert_many((name,score) for name,(score,on_recorded)
+                                                      in pending.items())
+            except Exception as error:
+                self.report(error)
+            for name,score in recorded:
+                on_recorded = pending[name][1]
+                if on_recorded is None:
+                    continue
+                # the scores are written, so a replay that fails to write
+                # neither skips the other replays nor the leaderboard
+                try:
+                    on_recorded()
+                except Exception as error:
+                    self.report(error)
+            if changed or recorded:
+                self.publish()
+            if closing:
+                return
+
+    def publish(self):
+        if self.on_leaderboard is not None:
+            self.schedule(self.on_leaderboard,self.store.top(self.top_size))
+
+    def report(self,error):
+        if self.on_error is not None:
+            self.schedule(self.on_error,error)
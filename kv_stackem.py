@@ -1,371 +1,674 @@
 from kivy.app import App
-from kivy.core.window import Window
+# kivy.core.window and kivy.uix.textinput open the window when they are
+# imported, so they are imported where the window is needed instead.
+# Importing this module for tools or benchmarks does not open a window.
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.button import Button
 from kivy.uix.label import Label, CoreLabel
-from kivy.uix.textinput import TextInput
 from kivy.uix.widget import Widget
 from kivy.uix.floatlayout import FloatLayout
-from kivy.graphics.vertex_instructions import Rectangle,Line
-from kivy.graphics.context_instructions import Color
+from kivy.graphics.vertex_instructions import Rectangle,Line,Mesh
+from kivy.graphics.context_instructions import Color,Translate,PushMatrix,PopMatrix
 from kivy.clock import Clock
-from kivy.graphics.instructions import InstructionGroup
+from kivy.logger import Logger
+from kivy.graphics.instructions import InstructionGroup,RenderContext
 import numpy as np
+import os
+import time
+from collections import OrderedDict, deque
+from stackem_engine import StackEm
+from highscores import HighscoreWorker
+from profiler import DropLatency, Profiler
+from replay import Replay, replay_path
+from watchdog import MemoryWatch, count_instructions
 
 
 class Block:
     '''
     Custom class to create InstructionGroup for 
     each block that will be used in the game.
+    The position and colour come from a BlockState of the game.
     '''
-    def __init__(self,x,y):
-        self.x = x
-        self.y = y
-        self.size = (40,60)
-        self.shape = Rectangle(pos=(self.x,self.y),
-                               size=self.size)
-        
-        # get the next colour each time a new block is created
-        colour_machine.step()
-        if colour_machine.state == 'red':
-            self.colour = Color(1,0,0,1)
-        elif colour_machine.state == 'green':
-            self.colour = Color(0,1,0,1)
-        elif colour_machine.state == 'blue':
-            self.colour = Color(0,0,1,1)
+    __slots__ = ('state','shape','colour','instruction')
+    
+    colours = {'red':(1,0,0,1),
+               'green':(0,1,0,1),
+               'blue':(0,0,1,1)}
+    
+    def __init__(self,state):
+        self.state = state
+        self.shape = Rectangle(pos=(state.x,state.y),
+                               size=state.size)
+        self.colour = Color(*self.colours[state.colour])
         
         # create canvas instruction
         self.instruction = InstructionGroup()
         self.instruction.add(self.colour)
         self.instruction.add(self.shape)
-
         
-# State Machines
-class SM:    
+    def assign(self,state):
+        '''
+        Reuses the Block and its instructions to draw another BlockState.
+        '''
+        self.state = state
+        self.colour.rgba = self.colours[state.colour]
+        self.shape.size = state.size
+        
+    def update(self,offset_y=0):
+        '''
+        Moves the Rectangle in place to the position of the BlockState,
+        offset_y lower, e.g. scroll_y for the building block. Tower blocks
+        are drawn at their own x and y inside the tower group, whose
+        Translate moves them by tower_x.
+        '''
+        self.shape.pos = (self.state.x,self.state.y-offset_y)
+
+
+class ScrollTween:
     '''
-    Custom state machine parent class
-    that does not require inputs.
+    Scroll offset the tower is drawn with. It follows StackEm.scroll_y
+    over duration seconds with an ease-out, so the tower slides down
+    instead of jumping a block in one frame.
     '''
-    def __init__(self):
-        self.state = None
+    # seconds a scroll takes, 0 to jump at once
+    duration = 0.2
+    
+    def __init__(self,game):
+        self.game = game
+        self.reset()
         
-    def start(self):
-        self.state = self.start_state
+    def reset(self):
+        '''
+        Jumps to the scroll of the game, e.g. after a restart.
+        '''
+        self.y = self.start = self.target = self.game.scroll_y
+        self.elapsed = 0
         
-    def step(self):
-        state = self.state
-        ns, output = self.get_next_values(state)
-        self.state = ns
-        return output    
-    
-class colourSM(SM):
+    def step(self,dt):
+        '''
+        Advances the animation by dt seconds and returns the offset.
+        '''
+        target = self.game.scroll_y
+        if target != self.target:
+            # a new scroll starts from where the last one has got to
+            self.start = self.y
+            self.target = target
+            self.elapsed = 0
+        if self.y != target:
+            self.elapsed += dt
+            if self.elapsed >= self.duration:
+                self.y = target
+            else:
+                t = self.elapsed/self.duration
+                self.y = self.start+(target-self.start)*(1-(1-t)**3)
+        return self.y
+
+
+class BlockPool:
     '''
-    To vary the colour of the blocks.
+    Keeps the Blocks of removed blocks to draw new ones, so that landing,
+    removing the bottom block and restarting do not create instructions.
+    At most size Blocks are kept, i.e. the tower cap plus the building block.
     '''
-    start_state = 'blue'
-    
-    def get_next_values(self,state):
-        if state == 'red':
-            ns = 'green'
-        elif state == 'green':
-            ns = 'blue'
-        elif state == 'blue':
-            ns = 'red'
-        output = ns    # output is redundant for colourSM
-        return ns, output
+    def __init__(self,size):
+        self.size = size
+        self.free = []
+        # Blocks created and reused, to check that a long game stops creating
+        self.created = 0
+        self.reused = 0
+        
+    def acquire(self,state):
+        '''
+        Returns a Block drawing state.
+        '''
+        if self.free:
+            self.reused += 1
+            block = self.free.pop()
+            block.assign(state)
+            return block
+        self.created += 1
+        return Block(state)
     
-    
-class oscillateSM(SM):
+    def release(self,block):
+        if len(self.free) < self.size:
+            self.free.append(block)
+
+
+class BlockRenderer:
     '''
-    To vary the speed of the blocks as the game progresses.
+    Draws every block with its own Color and Rectangle.
+    The tower blocks are kept in one group moved sideways by the tower's
+    movement and down by the animated scroll of the view with a single
+    Translate, so moving and scrolling the tower cost the same at any height.
+    Blocks come from a BlockPool, so a game in progress creates none.
+    The bottom block stays drawn until the scroll animation has moved
+    it off the bottom of the window.
     '''
-    start_state = ['RIGHT',0]
-    coeff = 0
-    
-    def get_next_values(self, state):
-        unit = np.pi/2/20
-        direction = state[0]
-        pos = state[1]
-        step = self.coeff*np.cos(unit*pos)
-        if direction == 'RIGHT':
-            output = step
-            if pos < 20:
-                ns = ['RIGHT', state[1]+1]
-            else:    # position is 20
-                ns = ['LEFT', state[1]-1]
-                
-        elif direction == 'LEFT':
-            output = -step
-            if pos > -20:
-                ns = ['LEFT', state[1]-1]
-            else:     # position is -20
-                ns = ['RIGHT', state[1]+1]
-        return ns, output
+    def __init__(self,canvas,game):
+        self.game = game
+        self.view = ScrollTween(game)
+        # the tower cap, the building block and a block scrolling off
+        self.pool = BlockPool(game.max_blocks+2)
+        self.tower = deque()
+        # (scroll_y, Block) of removed blocks drawn until the view reaches scroll_y
+        self.removed = deque()
+        self.next_block = None
+        self.tower_translate = Translate(0,0)
+        self.tower_group = InstructionGroup()
+        self.next_group = InstructionGroup()
+        canvas.add(PushMatrix())
+        canvas.add(self.tower_translate)
+        canvas.add(self.tower_group)
+        canvas.add(PopMatrix())
+        canvas.add(self.next_group)
+        self.draw_blocks()
+        
+    def draw_blocks(self):
+        '''
+        Draws a Block from the pool for each block of the tower
+        and for the building block of the game.
+        '''
+        self.tower_group.clear()
+        self.next_group.clear()
+        for towerblock in self.tower:
+            self.pool.release(towerblock)
+        for scroll_y,towerblock in self.removed:
+            self.pool.release(towerblock)
+        self.removed.clear()
+        if self.next_block is not None:
+            self.pool.release(self.next_block)
+            
+        self.tower = deque(self.pool.acquire(towerblock) for towerblock in self.game.tower)
+        for towerblock in self.tower:
+            towerblock.update()
+            self.tower_group.add(towerblock.instruction)
+        self.next_block = self.pool.acquire(self.game.next_block)
+        self.next_group.add(self.next_block.instruction)
+        self.view.reset()
+        self.move_tower()
+        self.move_block()
+        
+    def move_tower(self):
+        self.tower_translate.xy = (self.game.tower_x,-self.view.y)
+        self.remove_scrolled(self.view.y)
+        
+    def move_block(self):
+        self.next_block.update(self.game.scroll_y)
+        
+    def remove_bottom(self):
+        '''
+        Takes the bottommost Block out of the tower after StackEm.check_tower.
+        It is drawn until the view has scrolled to the game's scroll_y, so
+        it slides off the bottom with the rest of the tower.
+        '''
+        self.removed.append((self.game.scroll_y,self.tower.popleft()))
+        
+    def remove_scrolled(self,scroll_y):
+        '''
+        Stops drawing the removed Blocks the view has scrolled past at scroll_y.
+        '''
+        while self.removed and self.removed[0][0] <= scroll_y:
+            towerblock = self.removed.popleft()[1]
+            self.tower_group.remove(towerblock.instruction)
+            self.pool.release(towerblock)
+            
+    def land(self):
+        '''
+        Moves the landed Block into the tower group
+        and draws the new building block.
+        '''
+        self.next_group.remove(self.next_block.instruction)
+        self.next_block.update()
+        self.tower_group.add(self.next_block.instruction)
+        self.tower.append(self.next_block)
+        
+        self.next_block = self.pool.acquire(self.game.next_block)
+        self.next_group.add(self.next_block.instruction)
+        self.move_block()
+        
+        # check_tower runs in the same tick as the landing
+        if len(self.tower) > len(self.game.tower):
+            self.remove_bottom()
+        self.move_tower()
+
+
+class LabelCache:
+    '''
+    LRU cache of label textures keyed by (text, font_size), so that
+    repeated labels like 'Great!' or 'Speed: 1.3' are rasterised once.
+    '''
+    def __init__(self,size=64):
+        self.size = size
+        self.textures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self,text,font_size):
+        '''
+        Returns the texture of text, rendering it with a new
+        CoreLabel if it is not cached.
+        '''
+        key = (text,font_size)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textures.move_to_end(key)
+            self.hits += 1
+            return texture
+        
+        # every CoreLabel owns its texture, so it is safe to keep
+        self.misses += 1
+        label = CoreLabel(text=text,font_size=font_size)
+        label.refresh()
+        texture = label.texture
+        self.textures[key] = texture
+        if len(self.textures) > self.size:
+            self.textures.popitem(last=False)
+        return texture
 
-# start the state machines
-colour_machine = colourSM()
-colour_machine.start()
 
-move_blockSM = oscillateSM()
-move_blockSM.start()
-move_blockSM.coeff = 4
+# shaders for MeshRenderer, which takes the colour from each vertex
+MESH_VS = '''
+#ifdef GL_ES
+    precision highp float;
+#endif
+attribute vec2 vPosition;
+attribute vec4 vColor;
+uniform mat4 modelview_mat;
+uniform mat4 projection_mat;
+varying vec4 frag_color;
+void main(void) {
+    frag_color = vColor;
+    gl_Position = projection_mat * modelview_mat * vec4(vPosition.xy, 0.0, 1.0);
+}
+'''
 
-move_towerSM = oscillateSM()
-move_towerSM.start()
-move_towerSM.coeff = 2
+MESH_FS = '''
+#ifdef GL_ES
+    precision highp float;
+#endif
+varying vec4 frag_color;
+void main(void) {
+    gl_FragColor = frag_color;
+}
+'''
+
+
+class MeshRenderer:
+    '''
+    Draws the tower as one vertex-coloured Mesh and the building block
+    as another, so the game takes two draw calls without colour changes.
+    The vertex buffers are NumPy arrays that are updated in place.
+    Every tower block has a quad slot of its own until it is removed and
+    the scroll animation has moved it off the bottom of the window, so
+    landing and removing a block each write one quad. The tower Mesh
+    is moved by a single Translate, so a frame only writes the 4 vertices
+    of the building block at any tower height.
+    '''
+    fmt = [(b'vPosition',2,'float'),(b'vColor',4,'float')]
+    corners = np.array([[0,0],[1,0],[1,1],[0,1]],dtype=np.float32)
+    quad = np.array([0,1,2,2,3,0],dtype=np.uint16)
+    
+    def __init__(self,canvas,game):
+        self.game = game
+        self.view = ScrollTween(game)
+        self.capacity = 0
+        self.context = RenderContext(use_parent_projection=True,
+                                     use_parent_modelview=True)
+        self.context.shader.vs = MESH_VS
+        self.context.shader.fs = MESH_FS
+        self.tower_translate = Translate(0,0)
+        self.mesh = Mesh(fmt=self.fmt,mode='triangles')
+        self.next_vertices = np.zeros((4,6),dtype=np.float32)
+        self.next_mesh = Mesh(fmt=self.fmt,mode='triangles',indices=self.quad.tolist())
+        self.context.add(PushMatrix())
+        self.context.add(self.tower_translate)
+        self.context.add(self.mesh)
+        self.context.add(PopMatrix())
+        self.context.add(self.next_mesh)
+        canvas.add(self.context)
+        self.draw_blocks()
+        
+    def reserve(self,count):
+        '''
+        Allocates the buffers for a tower of count blocks.
+        '''
+        if count == self.capacity:
+            return
+        self.capacity = count
+        # 4 vertices of (x, y, r, g, b, a) per block, relative to
+        # (tower_x, scroll_y); an empty slot has all corners at one point,
+        # which draws nothing
+        self.vertices = np.zeros((count,4,6),dtype=np.float32)
+        self.flat_vertices = self.vertices.reshape(-1)
+        offsets = np.arange(count,dtype=np.uint16)[:,None]*4
+        self.mesh.indices = (offsets+self.quad).reshape(-1)
+        
+    def draw_blocks(self):
+        '''
+        Writes every block into the buffers.
+        '''
+        # one more slot for a removed block scrolling off
+        self.reserve(max(self.game.max_blocks,len(self.game.tower))+1)
+        self.vertices[:] = 0
+        # slots of the tower blocks from the bottom, and the empty ones
+        self.slots = deque()
+        self.free = list(range(self.capacity-1,-1,-1))
+        # (scroll_y, slot) of removed blocks drawn until the view reaches scroll_y
+        self.removed = deque()
+        for towerblock in self.game.tower:
+            self.add_block(towerblock)
+        self.mesh.vertices = self.flat_vertices
+        self.draw_next_block()
+        self.view.reset()
+        self.move_tower()
+        
+    def add_block(self,towerblock):
+        '''
+        Writes a tower block into a free slot.
+        '''
+        slot = self.free.pop()
+        self.slots.append(slot)
+        position = (towerblock.x,towerblock.y)
+        self.vertices[slot,:,:2] = self.corners*towerblock.size+position
+        self.vertices[slot,:,2:] = Block.colours[towerblock.colour]
+        
+    def draw_next_block(self):
+        self.next_vertices[:,2:] = Block.colours[self.game.next_block.colour]
+        self.move_block()
+        
+    def move_tower(self):
+        self.tower_translate.xy = (self.game.tower_x,-self.view.y)
+        if self.removed and self.remove_scrolled(self.view.y):
+            self.mesh.vertices = self.flat_vertices
+        
+    def move_block(self):
+        block = self.game.next_block
+        self.next_vertices[:,:2] = self.corners*block.size+(block.x,block.y-self.game.scroll_y)
+        self.next_mesh.vertices = self.next_vertices.reshape(-1)
+        
+    def remove_bottom(self):
+        '''
+        Takes the bottom block's slot out of the tower. The block is drawn
+        until the view has scrolled to the game's scroll_y.
+        '''
+        self.removed.append((self.game.scroll_y,self.slots.popleft()))
+        
+    def remove_scrolled(self,scroll_y):
+        '''
+        Empties the slots of the removed blocks the view has scrolled past
+        at scroll_y. Returns True if any slot was emptied.
+        '''
+        emptied = False
+        while self.removed and self.removed[0][0] <= scroll_y:
+            slot = self.removed.popleft()[1]
+            self.vertices[slot,:,:2] = 0
+            self.free.append(slot)
+            emptied = True
+        return emptied
+        
+    def land(self):
+        '''
+        Writes the landed block into a free slot, removes the bottom
+        block if check_tower removed it and draws the new building block.
+        '''
+        if not self.free:
+            # a block landed before the last one scrolled off
+            self.remove_scrolled(float('inf'))
+        if not self.free:
+            # the tower cap was raised, e.g. by a benchmark
+            self.draw_blocks()
+            return
+        self.add_block(self.game.tower[-1])
+        if len(self.slots) > len(self.game.tower):
+            self.remove_bottom()
+        self.mesh.vertices = self.flat_vertices
+        self.draw_next_block()
 
 
 class GameWidget(Widget):
-    drop,lose = (False,False)
-    tower = [Block(230,0)]
-    next_block = Block(230,520)
+    # 'blocks' draws a Rectangle per block, 'mesh' draws all blocks in one Mesh
+    render_mode = 'blocks'
+    renderers = {'blocks':BlockRenderer,'mesh':MeshRenderer}
+    
+    # stop scheduling self.update once the game is lost
+    stop_when_lost = False
+    
+    # number of label textures kept by the label cache
+    label_cache_size = 64
+    
+    # .csv or .json file the callback timings are written to on exit;
+    # None turns off profiling and the timings overlay
+    profile_path = None
     
-    score = 0
-    speed = 1.0
+    # seconds between samples of the traced memory and instruction counts,
+    # logged with their growth per minute; None turns off the watchdog
+    watch_interval = None
     
     def __init__(self,**kwargs):
         Widget.__init__(self,**kwargs)
+        # game rules and state
+        self.game = StackEm()
+        
         # create keyboard
+        from kivy.core.window import Window
         self.keyboard = Window.request_keyboard(self.keyboard_closed, self)
         self.keyboard.bind(on_key_down=self.on_keyboard_down)
+        # Clock.time() of every SPACE press since the last update
+        self.presses = []
         
         # custom events
         self.register_event_type('on_land')
         self.bind(on_land=self.check_landing)
         
-        # canvas core labels        
-        self.lose_label = CoreLabel(text='',font_size=40)
-        self.lose_label.refresh()
-        self.lose_instruction = Rectangle(texture=self.lose_label.texture,
-                                          pos=(85,430),size=self.lose_label.texture.size)
+        # canvas core labels, with textures from the label cache
+        self.label_cache = LabelCache(self.label_cache_size)
+        self.lose_instruction = Rectangle(pos=(85,430))
+        self.set_label(self.lose_instruction,'',40)
         
-        self.aim_label = CoreLabel(text='',font_size=20)
-        self.aim_label.refresh()
-        self.aim_instruction = Rectangle(texture=self.aim_label.texture,
-                                         pos=(415,300),size=self.aim_label.texture.size)
+        self.aim_instruction = Rectangle(pos=(415,300))
+        self.set_label(self.aim_instruction,'',20)
         
-        self.score_label = CoreLabel(text='Score: 0',font_size=20)
-        self.score_label.refresh()
-        self.score_instruction = Rectangle(texture=self.score_label.texture,
-                                          pos=(400,530),size=self.score_label.texture.size)
+        self.score_instruction = Rectangle(pos=(400,530))
+        self.set_label(self.score_instruction,'Score: 0',20)
         
-        self.speed_label = CoreLabel(text='Speed: 1.0',font_size=20)
-        self.speed_label.refresh()
-        self.speed_instruction = Rectangle(texture=self.speed_label.texture,
-                                         pos=(400,485),size=self.speed_label.texture.size)
+        self.speed_instruction = Rectangle(pos=(400,485))
+        self.set_label(self.speed_instruction,'Speed: 1.0',20)
         
         self.canvas.add(self.lose_instruction)
         self.canvas.add(self.score_instruction)
         self.canvas.add(self.aim_instruction)
         self.canvas.add(self.speed_instruction)
         
+        # timings overlay, redrawn twice a second while profiling
+        self.profiler = None
+        if self.profile_path is not None:
+            self.profiler = Profiler()
+            self.profiler.instrument(self.game)
+            self.latency = DropLatency(self.profiler)
+            self.profile_instruction = Rectangle(pos=(235,390))
+            self.canvas.add(self.profile_instruction)
+        
         # graphics        
         line_instruction = InstructionGroup()
         line_instruction.add(Color(1,1,1,1))
         line_instruction.add(Line(points=[0,518,500,518],width=2))
         self.canvas.add(line_instruction)
-        self.canvas.add(self.next_block.instruction)
-        
-        # run these functions continuously
-        Clock.schedule_interval(self.move_tower,0.02)
-        Clock.schedule_interval(self.move_block, 0.04)
-        Clock.schedule_interval(self.drop_block,0)
-        Clock.schedule_interval(self.check_tower,0)
+        self.renderer = self.renderers[self.render_mode](self.canvas,self.game)
+        if self.profiler is not None:
+            self.profiler.instrument(self.renderer.view,('step',),'scroll.')
+            self.profiler.instrument(self.renderer,('move_tower','move_block'),'draw.')
+        
+        # memory and instruction counts, sampled while the game runs
+        self.watch = None
+        if self.watch_interval is not None:
+            self.watch = MemoryWatch(self.watch_counters())
+            self.watch.start()
+        
+        # self.update is scheduled by self.start()
+        self.update_event = None
+        self.profile_event = None
+        self.watch_event = None
         
-    def move_tower(self,dt):
+    def start(self):
         '''
-        Oscillates the towers based on 
-        the step size from move_towerSM.
+        Schedules self.update on every frame.
         '''
-        step_size = move_towerSM.step()
-        for towerblock in self.tower:
-            self.canvas.remove(towerblock.instruction)
-            towerblock.x += step_size
-            towerblock.shape.pos = (towerblock.x,towerblock.y)
-            towerblock.instruction.add(towerblock.shape)
-            self.canvas.add(towerblock.instruction)
-    
-    def move_block(self,dt):
-        '''
-        Oscillates the building block based on 
-        the step size from move_blockSM.
-        '''
-        if self.drop == False:
-            step_size = move_blockSM.step()
-            self.canvas.remove(self.next_block.instruction)
-            self.next_block.x += step_size
-            self.next_block.shape.pos = (self.next_block.x,self.next_block.y)
-            self.next_block.instruction.add(self.next_block.shape)
-            self.canvas.add(self.next_block.instruction)
+        if self.update_event is None:
+            self.presses = []
+            if self.profiler is None:
+                self.update_event = Clock.schedule_interval(self.update,0)
+            else:
+                self.update_event = Clock.schedule_interval(self.profiled_update,0)
+                self.profile_event = Clock.schedule_interval(self.update_profile,0.5)
+        if self.watch is not None and self.watch_event is None:
+            self.watch_event = Clock.schedule_interval(self.update_watch,self.watch_interval)
             
-    def check_tower(self,dt):
+    def stop(self):
+        '''
+        Stops scheduling self.update until self.start() is called.
+        '''
+        if self.update_event is not None:
+            self.update_event.cancel()
+            self.update_event = None
+        if self.profile_event is not None:
+            self.profile_event.cancel()
+            self.profile_event = None
+        if self.watch_event is not None:
+            self.watch_event.cancel()
+            self.watch_event = None
+        
+    def update(self,dt):
+        '''
+        Advances the game by dt in fixed ticks, then draws it once.
+        SPACE presses start the drop from the time they were pressed.
+        '''
+        # dt is the time since the last frame, Clock.get_time() the time of this one
+        start = Clock.get_time()-dt
+        presses = [stamp-start for stamp in self.presses]
+        self.presses = []
+        result = self.game.step(dt,presses)
+        self.renderer.view.step(dt)
+        self.renderer.move_tower()
+        self.renderer.move_block()
+        
+        if result is not None:
+            self.dispatch('on_land',result)
+            if self.game.lose and self.stop_when_lost:
+                self.stop()
+    
+    def profiled_update(self,dt):
         '''
-        Removes the bottommost block if 
-        tower is more than 4 blocks tall.
+        Calls self.update, recording the time between frames
+        as 'frame', the time of the update as 'update' and the time
+        from a SPACE press to the update that moved the block as
+        'input.latency'.
         '''
-        if len(self.tower) == 5:
-            self.canvas.remove(self.tower[0].instruction)
-            self.tower.pop(0)
-            
-            # shift remaining blocks down
-            for towerblock in self.tower:                
-                towerblock.y -= towerblock.size[1]
-            
-    def drop_block(self,dt):
+        self.profiler.add('frame',int(dt*1e9))
+        self.latency.before(self.game,self.presses)
+        start = time.perf_counter_ns()
+        self.update(dt)
+        self.profiler.add('update',time.perf_counter_ns()-start)
+        self.latency.after(self.game,Clock.time())
+        
+    def update_profile(self,dt):
         '''
-        Drops the building block was the SPACEBAR is pressed.
+        Redraws the timings overlay. Its text changes every time,
+        so it is not kept in the label cache.
         '''
-        if self.drop == False:
-            return
+        label = CoreLabel(text=self.profiler.text(),font_size=10,
+                          font_name='RobotoMono-Regular')
+        label.refresh()
+        self.profile_instruction.texture = label.texture
+        self.profile_instruction.size = label.texture.size
         
-        current_y = self.next_block.y
-        top_towerblock = len(self.tower)-1
-        top_towerblock_y = self.tower[top_towerblock].y
-        height = self.tower[top_towerblock].size[1]
-        
-        if current_y > top_towerblock_y+height:
-            # change y coordinate and redraw
-            self.canvas.remove(self.next_block.instruction)
-            self.next_block.y -= 450*dt
-            self.next_block.shape.pos = (self.next_block.x,self.next_block.y)
-            self.next_block.instruction.add(self.next_block.shape)
-            self.canvas.add(self.next_block.instruction)
-            
-        if current_y <= top_towerblock_y+height:
-            # stop dropping
-            self.next_block.y = top_towerblock_y+height
-            self.drop = False
-            
-            self.dispatch('on_land',dt)
-    
-    def check_landing(self,value,dt):
+    def watch_counters(self):
         '''
-        Checks the accuracy of the landing. 
-        Update score, speed and labels accordingly.
+        Returns the counters of the watchdog: the instructions of the canvas
+        and of every group of the renderer, the cached label textures and
+        the Blocks created by the renderer's pool.
         '''
-        top_block = len(self.tower)-1
-        top_x = self.tower[top_block].x
-        top_y = self.tower[top_block].y
-        width = self.tower[top_block].size[0]
-        height = self.tower[top_block].size[1]
-                
-        # failed landing
-        if self.next_block.x<top_x-width or self.next_block.x>top_x+width:
-            self.lose = True
-            self.update_labels('lose')
+        counters = {'canvas':lambda: count_instructions(self.canvas)}
+        for name,value in vars(self.renderer).items():
+            if isinstance(value,InstructionGroup):
+                counters[name] = lambda group=value: count_instructions(group)
+        counters['labels'] = lambda: len(self.label_cache.textures)
+        if hasattr(self.renderer,'pool'):
+            counters['blocks'] = lambda: self.renderer.pool.created
+        return counters
         
-        # successful landing
-        else:
-            self.score += 1
-            
-            # bad landing        
-            if self.next_block.x<top_x-0.5*width or self.next_block.x>top_x+0.5*width:
-                self.update_labels('Bad..')
-                if move_towerSM.coeff<=14:
-                    move_towerSM.coeff *= 1.2
-                    move_blockSM.coeff *= 1.2
-                    self.speed += 0.2                    
-                    
-            # good landing        
-            elif self.next_block.x<top_x-0.1*width or self.next_block.x>top_x+0.1*width:
-                self.update_labels('Good')
-                if move_towerSM.coeff<=14:
-                    move_towerSM.coeff *= 1.1
-                    move_blockSM.coeff *= 1.1
-                    self.speed += 0.1
-                    
-            # great landing
-            else:
-                self.update_labels('Great!')
-                if move_towerSM.coeff>2:
-                    self.speed -= 0.1
-                    move_towerSM.coeff *= 0.9
-                    move_blockSM.coeff *= 0.9
-                
-        # append next_block to self.tower
-        self.tower.append(self.next_block)
+    def update_watch(self,dt):
+        '''
+        Samples the watchdog and logs every value with its growth per minute.
+        '''
+        self.watch.sample(Clock.get_boottime())
+        for line in self.watch.text().splitlines():
+            Logger.info('Watchdog: '+line)
+        
+    def check_landing(self,value,result):
+        '''
+        Updates the labels after StackEm.check_landing.
+        Moves the landed block to the tower and draws the new building block.
+        '''
+        self.update_labels(result)
+        self.renderer.land()
         
-        # update labels, draw new building block
+        # update labels
         self.update_speed()
         self.update_score()
-        self.draw_new_block()
+        
+    def set_label(self,instruction,text,font_size):
+        '''
+        Draws text with the Rectangle instruction,
+        using a texture from the label cache.
+        '''
+        texture = self.label_cache.get(text,font_size)
+        instruction.texture = texture
+        instruction.size = texture.size
         
     def update_labels(self,result):
         '''
         Updates aim and lose label.
         '''
         if result == 'lose':
-            self.aim_label.text = ''
-            
-            self.lose_label.text = "OH NO! YOU LOST!"
-            self.lose_label.refresh()
-            self.lose_instruction.texture = self.lose_label.texture
-            self.lose_instruction.size = self.lose_label.texture.size
+            self.set_label(self.aim_instruction,'',20)
+            self.set_label(self.lose_instruction,"OH NO! YOU LOST!",40)
             
         elif result == 'restart':
-            self.aim_label.text = ''
-            
-            self.lose_label.text = ''
-            self.lose_label.refresh()
-            self.lose_instruction.texture = self.lose_label.texture
-            self.lose_instruction.size = self.lose_label.texture.size
+            self.set_label(self.aim_instruction,'',20)
+            self.set_label(self.lose_instruction,'',40)
             
         else:
-            self.aim_label.text = result
-        self.aim_label.refresh()
-        self.aim_instruction.texture = self.aim_label.texture
-        self.aim_instruction.size = self.aim_label.texture.size
+            self.set_label(self.aim_instruction,result,20)
         
     def update_speed(self):
         '''
         Updates speed label.
         '''
-        self.speed_label.text = "Speed: " + str(round(self.speed,1))
-        self.speed_label.refresh()
-        self.speed_instruction.texture = self.speed_label.texture
-        self.speed_instruction.size = self.speed_label.texture.size
+        text = "Speed: " + str(round(self.game.speed,1))
+        self.set_label(self.speed_instruction,text,20)
             
     def update_score(self):
         '''
         Updates score label.
         '''
-        self.score_label.text = "Score: " + str(self.score)
-        self.score_label.refresh()
-        self.score_instruction.texture = self.score_label.texture
-        self.score_instruction.size = self.score_label.texture.size
+        text = "Score: " + str(self.game.score)
+        self.set_label(self.score_instruction,text,20)
         
-    def draw_new_block(self):
-        '''
-        Creates a new Block object at the starting position.
-        '''
-        move_blockSM.start()
-        self.next_block = Block(230,520)
-        self.canvas.add(self.next_block.instruction)
-            
     def restart(self):
         '''
         Reset tower and building blocks, 
         SM, class variables and labels.
         '''
-        for towerblock in self.tower:
-            self.canvas.remove(towerblock.instruction)
-        self.tower = [Block(230,0)]
-        self.canvas.remove(self.next_block.instruction)
-        self.next_block = Block(230,520)
-        move_blockSM.start()
-        move_towerSM.start()
-        move_blockSM.coeff = 4
-        move_towerSM.coeff = 2
+        self.game.restart()
+        self.renderer.draw_blocks()
+        self.start()
         
         # reset labels
-        self.score = 0
-        self.speed = 1.0
         self.update_score()
         self.update_speed()
         self.update_labels('restart')
-        self.drop,self.lose = (False,False)
         
-    def on_land(self,dt):
+    def on_land(self,result):
         '''
         Default handler for the custom event 'on_land'.
         '''
@@ -376,24 +679,24 @@ class GameWidget(Widget):
     
     def on_keyboard_down(self, keyboard, keycode, text, modifiers):
         '''
-        Listens for SPACE BAR key down to trigger self.drop_block().
+        Listens for SPACE BAR key down to start dropping the building block.
+        The press is timed when it arrives and applied by the next update.
         '''
         if self.manager.current == 'play':
-            if keycode[1] == 'spacebar' and self.lose == False:
-                self.drop = True
+            if keycode[1] == 'spacebar':
+                self.presses.append(Clock.time())
 
         
 class StartScreen(Screen):
-    username = ''
     
-    sorted_names = []
-    sorted_scores = []
-    
-    panel1_text = ''
+    # shown until the highscores are loaded
+    panel1_text = 'Loading...'
     panel2_text = ''
     
-    def __init__(self, **kwargs):
+    def __init__(self, highscores, **kwargs):
+        from kivy.uix.textinput import TextInput
         Screen.__init__(self, **kwargs)
+        self.highscores = highscores
 
         self.layout = FloatLayout(size=(500,650))
         
@@ -449,95 +752,57 @@ class StartScreen(Screen):
         
         self.add_widget(self.layout)
         
-        # prepare data and string text for leaderboard/panels
-        highscores = self.check_highscores()
-        sorted_names,sorted_scores = self.sort_highscores(highscores)
-        self.display_leaderboard(sorted_names,sorted_scores)
+    def display_leaderboard(self,top):
+        '''
+        Prepares the text of the top 10 (name, score) pairs
+        sent by the highscore worker. Changes text in the panels.
+        '''
+        lines = []
+        for name,score in top:
+            if score<10:
+                score=str(score)+'  '
+            else:
+                score=str(score)
+            lines.append(score+'  '+name+'\n')
+        self.panel1_text = ''.join(lines[:5])
+        self.panel2_text = ''.join(lines[5:])
         
+        # change text in lbl_panel 1 & 2
+        self.lbl_panel1.text = self.panel1_text
+        self.lbl_panel2.text = self.panel2_text
         
-    def check_highscores(self):
+    def display_error(self):
         '''
-        Reads the file highscores.txt and 
-        returns a dictionary containing all the names and scores.
+        Replaces the leaderboard, or its placeholder, when the
+        highscores cannot be loaded.
         '''
-        highscores = {}
-        f = open("highscores.txt",'r')
-        line = f.readline()
-        while line:
-            details = line.split(',')
-            name = details[0]
-            score = int(details[1].rstrip())
-            highscores[name] = score
-            line = f.readline()
-        f.close()
-        return highscores
-    
-    def sort_highscores(self,highscores):
-        '''
-        Returns a list of sorted_scores in descending order 
-        and the corresponding names in sorted_names.
-        '''
-        sorted_scores = []
-        sorted_names = []
-        namelist = list(highscores.keys())
-        unsorted_scores = list(highscores.values())
-        sorted_scores = unsorted_scores[:]
-        sorted_scores.sort()
-        sorted_scores.reverse()
-                
-        for score in sorted_scores:
-            for i,name in enumerate(namelist):
-                if score == unsorted_scores[i]:
-                    if name not in sorted_names:
-                        sorted_names.append(name)
-                        
-        StartScreen.sorted_names = sorted_names
-        StartScreen.sorted_scores = sorted_scores
-        return sorted_names,sorted_scores
-    
-    def display_leaderboard(self,sorted_names,sorted_scores):
-        '''
-        Prepares the text to be displayed on the leaderboard.
-        Changes text in the panels.
-        '''
-        for i in range(0,11):
-            try:
-                if sorted_scores[i]<10:
-                    score=str(sorted_scores[i])+'  '
-                else:
-                    score=str(sorted_scores[i])
-                if i<5:
-                    self.panel1_text+=score+'  '+sorted_names[i]+'\n'
-                else:
-                    self.panel2_text+=score+'  '+sorted_names[i]+'\n'
-            except:
-                pass
-        # change text in lbl_panel 1 & 2
+        self.panel1_text = 'Highscores unavailable'
+        self.panel2_text = ''
         self.lbl_panel1.text = self.panel1_text
         self.lbl_panel2.text = self.panel2_text
         
     def refresh_leaderboard(self,value):
         '''
-        Update the highscores and display leaderboard.
+        Asks the highscore worker to read the highscores saved since
+        the last read. It sends the leaderboard if any of them changed.
         '''
-        self.panel1_text = ''
-        self.panel2_text = ''
-        highscores = self.check_highscores()
-        sorted_names,sort_scores = self.sort_highscores(highscores)
-        self.display_leaderboard(sorted_names,sort_scores)
+        self.highscores.refresh()
     
     def change_to_play(self,value):
         '''
         Changes screen to play screen.
         '''
+        self.manager.get_screen('play').username = self.ti_username.text
         self.manager.transition.direction='left'
         self.manager.current='play'
-        StartScreen.username = self.ti_username.text
         
 class PlayScreen(Screen,GameWidget):
     
-    def __init__(self, **kwargs):
+    def __init__(self, highscores, **kwargs):
         super().__init__(**kwargs)
+        self.highscores = highscores
+        # set by the start screen
+        self.username = ''
         self.layout = FloatLayout(size=(500,600))
         btn_return = Button(text='Return',font_size=15,
                            pos_hint={'top':0.8,'x':0},
@@ -559,6 +824,18 @@ class PlayScreen(Screen,GameWidget):
         
         self.add_widget(self.layout)
                 
+    def on_enter(self):
+        '''
+        Runs the game while the play screen is shown.
+        '''
+        self.start()
+        
+    def on_leave(self):
+        '''
+        Stops scheduling the game while the play screen is hidden.
+        '''
+        self.stop()
+                
     def change_to_start(self,value):
         '''
         Changes screen to start screen.
@@ -574,43 +851,66 @@ class PlayScreen(Screen,GameWidget):
         
     def save_game(self,value):
         '''
-        Saves the player's username and 
-        score into the file highscores.txt.
+        Queues the player's score on the highscore worker, which saves
+        it if it beats the player's previous highscore.
+        The replay of the game is then kept as proof of the highscore.
         '''       
-        if StartScreen.username == '':
+        if self.username == '':
             # player did not enter username
             return
-        
-        if StartScreen.username not in StartScreen.sorted_names:
-            # add new entry if username does not exist
-            StartScreen.sorted_names.append(StartScreen.username)
-            StartScreen.sorted_scores.append(self.score)
-            f = open('highscores.txt','a')
-            f.write('{},{}\n'.format(StartScreen.username,self.score))
-        else:
-            # update the username's if it is a new highscore
-            new_text = ''
-            f = open('highscores.txt','w')
-            for pos,name in enumerate(StartScreen.sorted_names):
-                if name == StartScreen.username:
-                    previous_score = int(StartScreen.sorted_scores[pos])
-                    if previous_score < self.score:
-                        StartScreen.sorted_scores[pos] = str(self.score)
-            for i in range(len(StartScreen.sorted_names)):
-                new_text += StartScreen.sorted_names[i]+','+str(StartScreen.sorted_scores[i])+'\n'
-            f.write(new_text)
-        f.close()
+        username = self.username
+        replay = Replay.record(self.game)
+        if not self.highscores.save(username,self.game.score,
+                                    lambda: replay.save(replay_path(username))):
+            Logger.warning('Highscores: the score of {} was not saved'.format(username))
         
 # Run the game        
 class StackEmApp(App):
     def build(self):
         sm = ScreenManager()
-        start_screen = StartScreen(name='start')
-        play_screen = PlayScreen(name='play')
+        # the highscores are loaded and saved on a background thread,
+        # which sends its results back to the UI with Clock.schedule_once
+        highscores = HighscoreWorker('highscores.txt',schedule=self.schedule)
+        start_screen = StartScreen(highscores,name='start')
+        play_screen = PlayScreen(highscores,name='play')
+        highscores.on_leaderboard = start_screen.display_leaderboard
+        highscores.on_error = self.highscores_error
+        highscores.start()
         sm.add_widget(start_screen)
         sm.add_widget(play_screen)
         sm.current = 'start'
+        self.highscores = highscores
+        self.start_screen = start_screen
+        self.play_screen = play_screen
         return sm
+
+    def schedule(self,function,*args):
+        '''
+        Calls function(*args) on the UI thread before the next frame.
+        '''
+        Clock.schedule_once(lambda dt: function(*args))
+
+    def highscores_error(self,error):
+        Logger.warning('Highscores: could not read or save {}: {!r}'.format(
+            self.highscores.path,error))
+        if self.highscores.error is not None:
+            self.start_screen.display_error()
+    
+    def on_stop(self):
+        '''
+        Writes the queued highscores, and the timings of the game
+        to GameWidget.profile_path.
+        '''
+        self.highscores.close()
+        if self.play_screen.profiler is not None:
+            self.play_screen.profiler.dump(self.play_screen.profile_path)
     
-Window.size = (500,600)    
-StackEmApp().run()
\ No newline at end of file
+if __name__ == '__main__':
+    from kivy.core.window import Window
+    # e.g. STACKEM_PROFILE=timings.csv python kv_stackem.py
+    GameWidget.profile_path = os.environ.get('STACKEM_PROFILE')
+    # e.g. STACKEM_WATCH=60 python kv_stackem.py
+    if os.environ.get('STACKEM_WATCH'):
+        GameWidget.watch_interval = float(os.environ['STACKEM_WATCH'])
+    Window.size = (500,600)
+    StackEmApp().run()
@@ -1,167 +1,275 @@
-import pygame
+import os
+import time
+
 import numpy as np
+import pygame
+from profiler import DropLatency, Profiler
+from stackem_engine import StackEm, oscillateSM
+
+# One cycle of pgOscillateSM: RIGHT from 0 to 10, a step of 0 at ('RIGHT',11),
+# LEFT from 10 to -10, a step of 0 at ('LEFT',-11), then RIGHT from -10 to -1.
+# The range [-pi/2, pi/2] is divided into 21 positions in the range [-10,10].
+PG_OSCILLATE_STATES = ([('RIGHT',pos) for pos in range(0,12)]
+                       + [('LEFT',pos) for pos in range(10,-12,-1)]
+                       + [('RIGHT',pos) for pos in range(-10,0)])
+unit = np.pi/2/10
+PG_OSCILLATE_STEPS = tuple(0.0 if abs(pos) > 10
+                           else float(np.cos(unit*pos)) if direction == 'RIGHT'
+                           else -float(np.cos(unit*pos))
+                           for direction,pos in PG_OSCILLATE_STATES)
+
+class pgOscillateSM(oscillateSM):
+    '''Oscillator of the pygame version, over 21 positions'''
+    states = PG_OSCILLATE_STATES
+    steps = PG_OSCILLATE_STEPS
+    next_states = tuple(range(1,len(PG_OSCILLATE_STATES))) + (0,)
+    steps_twice = np.array(PG_OSCILLATE_STEPS*2)
+
+class PgStackEm(StackEm):
+    '''
+    Layout and rules of the pygame version with a 6 block tall tower.
+    The block moves every tick and the tower every second tick, both with
+    pgOscillateSM from a coefficient of 1 that changes by 1 at a time.
+    The block falls 10 px a tick and its oscillator does not start over.
+    '''
+    # y coordinates are measured upwards from the bottom of the window
+    start_pos = (230,570)
+    max_blocks = 6
+
+    drop_speed = 500
+    tower_ticks = 2
+    block_ticks = 1
+
+    oscillator = pgOscillateSM
+    tower_coeff = 1
+    block_coeff = 1
+    restart_block_oscillator = False
+
+    # px either side of the top block that count as an accurate landing
+    accuracy = 5
+
+    def grade_landing(self,x,top_x,width):
+        '''
+        Changes both coefficients by 1 after a block landed at x
+        on the top block at top_x. Returns 'Bad..' or 'Great!'.
+        '''
+        # accurate landing, which as in the original game also holds for every
+        # landing more than accuracy px to the left, so that only landings
+        # to the right speed the game up
+        if x<top_x-self.accuracy and x<top_x+self.accuracy:
+            self.move_towerSM.coeff -= 1
+            self.move_blockSM.coeff -= 1
 
-class SM:    
-    '''Custom state machine parent class that does not require input'''
-    def __init__(self):
-        self.state = None
-        
-    def start(self):
-        self.state = self.start_state
-        
-    def step(self):
-        state = self.state
-        ns, output = self.get_next_values(state)
-        self.state = ns
-        return output    
-    
-class oscillateSM(SM):
-    '''To vary the speed of the tower as the game progresses'''
-    start_state = ['RIGHT',0]
-    coeff = 1
-    
-    def get_next_values(self, state):
-        x_norm = np.pi/2/10
-        unit = x_norm*state[1]
-        if state[0] == 'RIGHT':
-            if state[1] <= 10:
-                output = self.coeff*np.cos(unit)
-                ns = ['RIGHT', state[1]+1]
-            else:
-                output = 0
-                ns = ['LEFT', state[1]-1]
-                
-        if state [0] == 'LEFT':
-            if state[1] >= -10:
-                output = -self.coeff*np.cos(unit)
-                ns = ['LEFT', state[1]-1]
-            else:
-                output = 0
-                ns = ['RIGHT', state[1]+1]
-        return ns, output
-
-class colourSM(SM):
-    '''To vary the colour of the building block'''
-    start_state = (255,0,0)
-    
-    def get_next_values(self,state):
-        if state == (255,0,0):
-            output = (0,255,0)
-        elif state == (0,255,0):
-            output = (0,0,255)
-        elif state == (0,0,255):
-            output = (255,0,0)
-        ns = output
-        return ns, output
-            
-class buildingBlock:
-    def __init__(self, x,y,width,height):
-        self.x = x
-        self.y = y
-        self.width = width
-        self.height = height
-        colourMachine.step()
-        self.colour = colourMachine.state
-    
-    def draw(self, win):
-        pygame.draw.rect(win, self.colour, (self.x,self.y,self.width,self.height))
-
-def redrawGameWindow():
-    win.fill((0,0,0))
-    pygame.draw.line(win,(200,200,200),(0,80),(screenWidth,80), 3)    
-    nextBlock.draw(win)
-    for block in tower:
-        block.draw(win)
-    pygame.display.update()
-    
-    
-# Main Code
-pygame.init()
-(screenWidth,screenHeight) = (500,650)
-win = pygame.display.set_mode((screenWidth,screenHeight))
-pygame.display.set_caption("Stack 'Em!")
-
-# start state machines
-colourMachine = colourSM()
-colourMachine.start()
-moveTower = oscillateSM()
-moveTower.start()
-moveNextBlock = oscillateSM()
-moveNextBlock.start()
-
-x_start, y_start = (230,20)
-r_width, r_height = (40, 60)
-run,drop, next_level, lose = (True, False, False, False)
-loopCount = 1
-
-tower = []
-startBlock = buildingBlock(230,screenHeight-r_height,r_width,r_height)
-tower.append(startBlock)
-nextBlock = buildingBlock(x_start,y_start,r_width,r_height)
-
-# main loop
-while run:
-    pygame.time.delay(20)
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            run = False
-            
-    # towerList
-    if len(tower) == 6:
-        tower.pop(0)
-        for block in tower:
-            block.y += r_height
-    
-    # drop the buildingblock onto the landingLine
-    topBlock = len(tower)-1
-    landingLine = tower[topBlock].y
-    if nextBlock.y < landingLine-r_height and drop == True:
-        nextBlock.y += 10
-        if nextBlock.y == landingLine-r_height:
-            drop = False
-            next_level = True
-    
-    # create new buildingblock upon landing
-    topBlock_x = tower[topBlock].x
-    if nextBlock.y == landingLine - r_height and next_level == True:
-        
-        # failed landing
-        if nextBlock.x < topBlock_x-40 or nextBlock.x > topBlock_x+40:
-            lose = True
-            
-        # accurate landing
-        if nextBlock.x < topBlock_x-5 and nextBlock.x < topBlock_x+5:
-            moveTower.coeff -= 1
-            moveNextBlock.coeff -= 1
-            
         # bad landing
-        if nextBlock.x < topBlock_x-5 or nextBlock.x > topBlock_x+5:
-            moveTower.coeff += 1
-            moveNextBlock.coeff += 1
-            
-        tower.append(nextBlock)
-        nextBlock = buildingBlock(x_start,y_start,r_width,r_height)
-        next_level = False
-
-    # change position of buildingblock within the boundary
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_SPACE] and lose == False:
-        drop = True
-    
-    # move nextBlock before it drops
-    if drop == False:
-        nextBlock.x += moveNextBlock.step()
-    
-    # moveTower every 2 loops
-    if loopCount == 2:
-        output = moveTower.step()
-        for block in tower:
-            block.x += output
-        loopCount = 1
-    else:
-        loopCount += 1
-            
-    redrawGameWindow()
-                    
-pygame.quit()
\ No newline at end of file
+        if x<top_x-self.accuracy or x>top_x+self.accuracy:
+            self.move_towerSM.coeff += 1
+            self.move_blockSM.coeff += 1
+            return 'Bad..'
+        return 'Great!'
+
+colours = {'red':(255,0,0),'green':(0,255,0),'blue':(0,0,255)}
+
+# frames per second the main loop is capped at
+FPS = 60
+
+def block_rect(win, block, scroll_y=0, tower_x=0):
+    '''
+    Rect of a BlockState scrolled by scroll_y, flipping y to pygame's top-left origin.
+    Pass tower_x for a tower block, whose x is relative to it.
+    '''
+    width, height = block.size
+    y = win.get_height()-(block.y-scroll_y)-height
+    return pygame.Rect(block.x+tower_x,y,width,height)
+
+def makeBackground(win):
+    '''Surface of everything that does not move: the black window and the guide line'''
+    background = pygame.Surface(win.get_size())
+    background.fill((0,0,0))
+    pygame.draw.line(background,(200,200,200),(0,80),(win.get_width(),80), 3)
+    return background.convert()
+
+
+class SpriteRenderer:
+    '''
+    Draws a StackEm with a LayeredDirty group of two DirtySprites, over a cached background.
+    The building block's image is one pre-filled Surface per colour of colourSM.
+    Landed blocks are blitted once into the tower sprite's image, so the tower's
+    oscillation only moves one rect and each frame costs the same at any tower height.
+    '''
+    # colour the tower image is transparent in, no block has it
+    colorkey = (0,0,0)
+
+    def __init__(self, win, game, background):
+        self.win = win
+        self.game = game
+        self.images = {}
+        width, height = win.get_size()
+        # the tower image reaches a window width either side of tower_x
+        self.origin = width
+        self.tower_image = pygame.Surface((2*width,height)).convert()
+        self.tower_image.fill(self.colorkey)
+        self.tower_image.set_colorkey(self.colorkey)
+        # area of tower_image that has blocks in it
+        self.bounds = pygame.Rect(0,0,0,0)
+        self.scroll_y = game.scroll_y
+        self.top = None
+
+        self.tower = pygame.sprite.DirtySprite()
+        self.tower.image = self.tower_image
+        self.tower.rect = pygame.Rect(0,0,0,0)
+        self.block = pygame.sprite.DirtySprite()
+        self.block.image = None
+        self.block.rect = pygame.Rect(0,0,0,0)
+        self.group = pygame.sprite.LayeredDirty()
+        self.group.add(self.tower, layer=0)
+        self.group.add(self.block, layer=1)
+        self.group.clear(win, background)
+        self.land()
+
+    def image(self, block):
+        '''Pre-filled Surface of a block's colour and size'''
+        key = (block.colour,block.size)
+        image = self.images.get(key)
+        if image is None:
+            image = self.images[key] = pygame.Surface(block.size).convert()
+            image.fill(colours[block.colour])
+        return image
+
+    def land(self):
+        '''Blits the blocks that landed since the last call into the tower image'''
+        game = self.game
+        landed = []
+        for block in reversed(game.tower):
+            if block is self.top:
+                break
+            landed.append(block)
+        for block in reversed(landed):
+            rect = block_rect(self.win, block, game.scroll_y)
+            rect.x = int(block.x)+self.origin
+            self.tower_image.blit(self.image(block), rect)
+            self.bounds = self.bounds.union(rect) if self.bounds.w else rect
+        self.bounds = self.bounds.clip(self.tower_image.get_rect())
+        self.top = game.tower[-1]
+        self.tower.source_rect = self.bounds
+        self.tower.dirty = 1
+
+    def scroll(self):
+        '''Moves the tower image down by how far the game scrolled'''
+        dy = int(self.game.scroll_y-self.scroll_y)
+        self.scroll_y = self.game.scroll_y
+        self.tower_image.scroll(0,dy)
+        self.tower_image.fill(self.colorkey, (0,0,self.tower_image.get_width(),dy))
+        self.bounds = self.bounds.move(0,dy).clip(self.tower_image.get_rect())
+        self.tower.source_rect = self.bounds
+        self.tower.dirty = 1
+
+    def draw(self):
+        '''Moves the sprites to the game's state and updates the rects they changed'''
+        game = self.game
+        if game.scroll_y != self.scroll_y:
+            self.scroll()
+        if game.tower[-1] is not self.top:
+            self.land()
+        topleft = (int(game.tower_x)-self.origin+self.bounds.x, self.bounds.y)
+        if topleft != self.tower.rect.topleft:
+            self.tower.rect.topleft = topleft
+            self.tower.dirty = 1
+
+        rect = block_rect(self.win, game.next_block, game.scroll_y)
+        if rect != self.block.rect or self.block.image is not self.image(game.next_block):
+            self.block.image = self.image(game.next_block)
+            self.block.rect = rect
+            self.block.dirty = 1
+        pygame.display.update(self.group.draw(self.win))
+
+    def redraw(self):
+        '''Redraws and updates the whole window, e.g. on the first frame'''
+        self.group.repaint_rect(self.win.get_rect())
+        self.draw()
+
+    def close(self):
+        '''
+        Empties the group, e.g. before drawing a new game with a new renderer.
+        Sprites and groups refer to each other, so without this a renderer
+        is only freed by the garbage collector's rare full collections.
+        '''
+        self.group.empty()
+
+
+def waitForFrame(deadline, presses):
+    '''
+    Handles events until time.perf_counter() reaches deadline, instead of sleeping,
+    so that every SPACE press is timed when it arrives and a quick tap is never missed.
+    Appends the time of every press to presses.
+    Returns the events other than SPACE presses.
+    '''
+    events = []
+    while True:
+        remaining = deadline-time.perf_counter()
+        if remaining > 0:
+            event = pygame.event.wait(max(1,int(remaining*1000)))
+        else:
+            event = pygame.event.poll()
+        if event.type == pygame.NOEVENT:
+            if remaining <= 0:
+                return events
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+            presses.append(time.perf_counter())
+        else:
+            events.append(event)
+
+
+def main():
+    pygame.init()
+    (screenWidth,screenHeight) = (500,650)
+    win = pygame.display.set_mode((screenWidth,screenHeight))
+    pygame.display.set_caption("Stack 'Em!")
+
+    game = PgStackEm()
+    renderer = SpriteRenderer(win, game, makeBackground(win))
+    renderer.redraw()
+    run = True
+
+    # times from a SPACE press to the frame that shows the block falling
+    profile_path = os.environ.get('STACKEM_PROFILE')
+    if profile_path is not None:
+        profiler = Profiler()
+        latency = DropLatency(profiler)
+
+    # main loop
+    last = deadline = time.perf_counter()
+    while run:
+        # frames are due every 1/FPS seconds, so a late wake-up does not delay
+        # the frames after it, unless the loop fell a whole frame behind
+        deadline = max(deadline+1/FPS, time.perf_counter())
+        presses = []
+        for event in waitForFrame(deadline, presses):
+            if event.type == pygame.QUIT:
+                run = False
+            elif event.type == pygame.WINDOWEXPOSED:
+                renderer.redraw()
+
+        # steps the game by the time the frame took, in fixed ticks,
+        # starting the drop from the time SPACE was pressed
+        now = time.perf_counter()
+        dt = now-last
+        if profile_path is not None:
+            profiler.add('frame', int(dt*1e9))
+            latency.before(game, presses)
+        ticks = game.ticks
+        game.step(dt, [stamp-last for stamp in presses])
+        last = now
+
+        # at more frames than ticks per second, some frames have nothing to draw
+        if game.ticks != ticks:
+            renderer.draw()
+        if profile_path is not None:
+            latency.after(game, time.perf_counter())
+                        
+    pygame.quit()
+    if profile_path is not None:
+        print(profiler.text())
+        profiler.dump(profile_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+'''
+Opt-in timing of the Stack 'Em! game callbacks.
+
+Profiler.instrument(game) replaces move_tower, move_block, drop_block,
+check_tower and check_landing of one StackEm object with versions timed
+by time.perf_counter_ns. Other games, and games that are not
+instrumented, run unchanged. drop_block calls check_landing, so its
+time includes a landing's.
+
+Every timer keeps its last durations for rolling percentiles, and the
+summary can be dumped as CSV or JSON to compare machines.
+
+DropLatency records the time from a SPACE press to the first frame
+that shows the building block falling.
+'''
+import csv
+import json
+import time
+from collections import deque
+
+CALLBACKS = ('move_tower','move_block','drop_block','check_tower','check_landing')
+PERCENTILES = (50,95,99)
+
+
+class Timer:
+    '''
+    Durations in nanoseconds of one callback.
+    Percentiles are over the last window calls, count, mean and max
+    over every call, so a single hitch is never forgotten.
+    '''
+    def __init__(self,window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self,ns):
+        self.samples.append(ns)
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentiles(self,qs=PERCENTILES):
+        '''
+        Returns the nearest-rank percentiles qs of the window in ns.
+        '''
+        if not self.samples:
+            return [0 for q in qs]
+        ordered = sorted(self.samples)
+        last = len(ordered)-1
+        return [ordered[min(last,len(ordered)*q//100)] for q in qs]
+
+    def summary(self):
+        '''
+        Returns count, mean, percentiles and max, in microseconds.
+        '''
+        entry = {'count':self.count,
+                 'mean_us':self.total/self.count/1000 if self.count else 0}
+        for q,ns in zip(PERCENTILES,self.percentiles()):
+            entry['p{}_us'.format(q)] = ns/1000
+        entry['max_us'] = self.max/1000
+        return entry
+
+
+class Profiler:
+    '''
+    Timers by name, for the callbacks of instrumented games and
+    anything else recorded with add().
+    '''
+    def __init__(self,window=1000):
+        self.window = window
+        self.timers = {}
+
+    def timer(self,name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer(self.window)
+        return timer
+
+    def add(self,name,ns):
+        self.timer(name).add(ns)
+
+    def wrap(self,name,function):
+        '''
+        Returns function timed under name.
+        '''
+        add = self.timer(name).add
+        clock = time.perf_counter_ns
+        def timed(*args):
+            start = clock()
+            result = function(*args)
+            add(clock()-start)
+            return result
+        return timed
+
+    def instrument(self,game,callbacks=CALLBACKS,prefix=''):
+        '''
+        Times the callbacks of one StackEm object, or the methods
+        named in callbacks of any object, by shadowing its methods with
+        instance attributes. The timers are named prefix+method.
+        Returns the object.
+        '''
+        for name in callbacks:
+            setattr(game,name,self.wrap(prefix+name,getattr(game,name)))
+        return game
+
+    def summary(self):
+        return {name:timer.summary() for name,timer in self.timers.items()}
+
+    def text(self):
+        '''
+        Returns one line of p50/p95/p99 in microseconds per timer.
+        '''
+        lines = ['{:<16}{:>9}{:>9}{:>9}'.format('us','p50','p95','p99')]
+        for name,timer in self.timers.items():
+            p50,p95,p99 = (ns/1000 for ns in timer.percentiles())
+            lines.append('{:<16}{:>9.1f}{:>9.1f}{:>9.1f}'.format(name,p50,p95,p99))
+        return '\n'.join(lines)
+
+    def dump(self,path):
+        '''
+        Writes the summary to path, as JSON if it ends in .json,
+        else as CSV with one row per timer.
+        '''
+        summary = self.summary()
+        with open(path,'w',newline='') as f:
+            if path.endswith('.json'):
+                json.dump(summary,f,indent=2)
+                return
+            fields = ['name','count','mean_us']+['p{}_us'.format(q) for q in PERCENTILES]+['max_us']
+            writer = csv.DictWriter(f,fields)
+            writer.writeheader()
+            for name,entry in summary.items():
+                writer.writerow(dict(entry,name=name))
+
+
+class DropLatency:
+    '''
+    Times from the moment a SPACE press arrived to the end of the first
+    frame in which the building block has moved down, under name.
+    Press times and now must come from the same clock, in seconds.
+    '''
+    def __init__(self,profiler,name='input.latency'):
+        self.add = profiler.timer(name).add
+        self.stamp = None
+        self.block = None
+        self.y = None
+
+    def before(self,game,presses):
+        '''
+        Called before stepping game with the press times of the frame.
+        '''
+        if self.stamp is None and presses and not game.drop and not game.lose:
+            self.stamp = presses[0]
+            self.block = game.next_block
+            self.y = game.next_block.y
+
+    def after(self,game,now):
+        '''
+        Called once the frame is drawn, at time now.
+        '''
+        if self.stamp is None:
+            return
+        # the block moved, or already landed and a new one is building
+        if game.next_block is not self.block or game.next_block.y != self.y:
+            self.add(int((now-self.stamp)*1e9))
+            self.stamp = None
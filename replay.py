@@ -0,0 +1,184 @@
+'''
+Deterministic replays of Stack 'Em! games.
+
+StackEm runs in fixed ticks and has no randomness, so a game is fully
+described by its starting state, the ticks at which SPACE started a
+drop and how long before the end of each of them it was pressed.
+A replay stores these in a compact binary stream and is played back
+without any window with StackEm.fast_forward, which only runs the
+ticks in which a block lands one by one.
+'''
+import hashlib
+import os
+import re
+import struct
+
+from stackem_engine import StackEm
+
+MAGIC = b'SEMR'
+VERSION = 3
+COLOURS = ('red','green','blue')
+
+# magic, version, start colour, max_blocks, block_ticks, then tick_interval,
+# drop_speed, base_pos, start_pos, tower_coeff and block_coeff as doubles
+HEADER = struct.Struct('<4sBBHB8d')
+SETTINGS = ('max_blocks','block_ticks','tick_interval','drop_speed',
+            'base_pos','start_pos','tower_coeff','block_coeff')
+
+# rules that a replay does not store, so only games that play by
+# StackEm's can be recorded, as kv_stackem.py does
+RULES = ('oscillator','tower_ticks','restart_block_oscillator',
+         'block_size','view_blocks','max_step')
+
+
+def replay_path(name,directory='replays'):
+    '''
+    Returns the path of the replay file kept for a player's highscore.
+    Names that only differ in characters that are not allowed in the
+    filename, e.g. 'a b' and 'a_b', are told apart by a hash of the name.
+    '''
+    os.makedirs(directory,exist_ok=True)
+    filename = re.sub(r'[^A-Za-z0-9_-]','_',name)
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(directory,'{}-{}.replay'.format(filename,digest))
+
+def write_varint(out,value):
+    '''
+    Appends value to the bytearray out, 7 bits per byte.
+    '''
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data,pos):
+    '''
+    Returns the varint in data at pos and the position after it.
+    '''
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value,pos
+        shift += 7
+
+
+class Replay:
+    '''
+    Starting state, presses and length of one game.
+    offsets are StackEm.press_offsets, one per press.
+    '''
+    def __init__(self,settings,start_colour,presses,offsets,ticks,score):
+        self.settings = settings
+        self.start_colour = start_colour
+        self.presses = presses
+        self.offsets = offsets
+        self.ticks = ticks
+        self.score = score
+
+    @classmethod
+    def record(cls,game):
+        '''
+        Returns the Replay of the current game of a StackEm object.
+        Raises ValueError for a game with other rules than StackEm's,
+        e.g. a PgStackEm, which the replay could not play back.
+        '''
+        if (any(getattr(game,name) != getattr(StackEm,name) for name in RULES)
+                or type(game).grade_landing is not StackEm.grade_landing):
+            raise ValueError('only games with the rules of StackEm can be recorded')
+        settings = {name:getattr(game,name) for name in SETTINGS}
+        return cls(settings,game.start_colour,list(game.presses),
+                   list(game.press_offsets),game.ticks,game.score)
+
+    def to_bytes(self):
+        '''
+        Header, then the number of presses, the gaps in ticks between
+        them, their offsets in microseconds, the total ticks and the
+        score as varints.
+        '''
+        s = self.settings
+        out = bytearray(HEADER.pack(MAGIC,VERSION,COLOURS.index(self.start_colour),
+                                    s['max_blocks'],s['block_ticks'],
+                                    s['tick_interval'],s['drop_speed'],
+                                    s['base_pos'][0],s['base_pos'][1],
+                                    s['start_pos'][0],s['start_pos'][1],
+                                    s['tower_coeff'],s['block_coeff']))
+        write_varint(out,len(self.presses))
+        previous = 0
+        for tick in self.presses:
+            write_varint(out,tick-previous)
+            previous = tick
+        for offset in self.offsets:
+            write_varint(out,offset)
+        write_varint(out,self.ticks)
+        write_varint(out,self.score)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls,data):
+        (magic,version,colour,max_blocks,block_ticks,tick_interval,drop_speed,
+         base_x,base_y,start_x,start_y,tower_coeff,block_coeff) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a Stack \'Em! replay')
+        settings = {'max_blocks':max_blocks,'block_ticks':block_ticks,
+                    'tick_interval':tick_interval,'drop_speed':drop_speed,
+                    'base_pos':(base_x,base_y),'start_pos':(start_x,start_y),
+                    'tower_coeff':tower_coeff,'block_coeff':block_coeff}
+
+        pos = HEADER.size
+        count,pos = read_varint(data,pos)
+        presses = []
+        tick = 0
+        for i in range(count):
+            gap,pos = read_varint(data,pos)
+            tick += gap
+            presses.append(tick)
+        offsets = []
+        for i in range(count):
+            offset,pos = read_varint(data,pos)
+            offsets.append(offset)
+        ticks,pos = read_varint(data,pos)
+        score,pos = read_varint(data,pos)
+        return cls(settings,COLOURS[colour],presses,offsets,ticks,score)
+
+    def save(self,path):
+        with open(path,'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls,path):
+        with open(path,'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def play(self):
+        '''
+        Runs the game again without rendering and returns the StackEm
+        object after the recorded number of ticks.
+        '''
+        game = StackEm()
+        for name,value in self.settings.items():
+            setattr(game,name,value)
+        game.colour_machine.state = self.start_colour
+        game.restart()
+
+        for press,offset in zip(self.presses,self.offsets):
+            game.fast_forward(press-game.ticks)
+            game.press_space(offset/1e6)
+        game.fast_forward(self.ticks-game.ticks)
+        return game
+
+    def verify(self):
+        '''
+        Returns True if playing the replay back reaches the recorded
+        score and the same presses, e.g. to check a saved highscore.
+        A replay whose settings differ from StackEm's is never a valid
+        proof, e.g. one that stops the tower with a tower_coeff of 0.
+        '''
+        if any(self.settings[name] != getattr(StackEm,name) for name in SETTINGS):
+            return False
+        game = self.play()
+        return (game.score == self.score and game.presses == self.presses
+                and game.press_offsets == self.offsets)
@@ -0,0 +1,495 @@
+'''
+Renderer-free simulation core for Stack 'Em!
+
+All the game rules live here so that a game can be stepped
+without Kivy or pygame, e.g. for balancing, replays and bots.
+kv_stackem.py and pg_stackem.py only draw the state of a StackEm object.
+'''
+import math
+from collections import deque
+
+import numpy as np
+
+
+# State Machines
+class SM:
+    '''
+    Custom state machine parent class
+    that does not require inputs.
+    '''
+    def __init__(self):
+        self.state = None
+
+    def start(self):
+        self.state = self.start_state
+
+    def step(self):
+        state = self.state
+        ns, output = self.get_next_values(state)
+        self.state = ns
+        return output
+
+class colourSM(SM):
+    '''
+    To vary the colour of the blocks.
+    '''
+    start_state = 'blue'
+
+    def get_next_values(self,state):
+        if state == 'red':
+            ns = 'green'
+        elif state == 'green':
+            ns = 'blue'
+        elif state == 'blue':
+            ns = 'red'
+        output = ns    # output is redundant for colourSM
+        return ns, output
+
+
+# One cycle of oscillateSM: RIGHT from 0 to 20, LEFT from 19 to -20,
+# then RIGHT from -19 to -1 before returning to ('RIGHT',0).
+# The range [-pi/2, pi/2] is divided into 41 positions in the range [-20,20].
+OSCILLATE_STATES = ([('RIGHT',pos) for pos in range(0,21)]
+                    + [('LEFT',pos) for pos in range(19,-21,-1)]
+                    + [('RIGHT',pos) for pos in range(-19,0)])
+
+# cos(unit*pos) for every state, negated when moving LEFT.
+# np.cos is called on each scalar, as the original step did,
+# so that coeff*OSCILLATE_STEPS[state] is bit-for-bit the same output.
+unit = np.pi/2/20
+OSCILLATE_STEPS = tuple(float(np.cos(unit*pos)) if direction == 'RIGHT'
+                        else -float(np.cos(unit*pos))
+                        for direction,pos in OSCILLATE_STATES)
+OSCILLATE_NEXT = tuple(range(1,len(OSCILLATE_STATES))) + (0,)
+
+
+class oscillateSM(SM):
+    '''
+    To vary the speed of the blocks as the game progresses.
+    The state is the index of the current position in states,
+    so each step is a table lookup multiplied by coeff.
+    A subclass with other tables oscillates over other positions.
+    '''
+    start_state = 0
+    coeff = 0
+
+    states = OSCILLATE_STATES
+    steps = OSCILLATE_STEPS
+    next_states = OSCILLATE_NEXT
+    # steps twice, so that up to a cycle of steps from any state is one slice
+    steps_twice = np.array(OSCILLATE_STEPS*2)
+
+    def get_next_values(self, state):
+        return self.next_states[state], self.coeff*self.steps[state]
+
+    def step(self):
+        state = self.state
+        self.state = self.next_states[state]
+        return self.coeff*self.steps[state]
+
+    def step_many(self,count):
+        '''
+        Returns the outputs of the next count steps as an array
+        and advances the state past them.
+        '''
+        cycle = len(self.next_states)
+        state = self.state
+        if count <= cycle:
+            steps = self.steps_twice[state:state+count]
+        else:
+            steps = self.steps_twice[(state+np.arange(count))%cycle]
+        self.state = (state+count)%cycle
+        return self.coeff*steps
+
+    @property
+    def direction(self):
+        return self.states[self.state][0]
+
+    @property
+    def position(self):
+        return self.states[self.state][1]
+
+
+class BlockState:
+    '''
+    Position, size and colour of a single block.
+    The colour is the state of colourSM when the block was created.
+    '''
+    __slots__ = ('x','y','colour','size')
+
+    def __init__(self,x,y,colour,size=(40,60)):
+        self.x = x
+        self.y = y
+        self.colour = colour
+        self.size = size
+
+
+class StackEm:
+    '''
+    Game state of Stack 'Em! that is stepped by a given dt.
+    The default layout and timings are the ones used by kv_stackem.py.
+    Blocks keep their y for as long as they are in the tower; the view
+    scrolls up instead, so blocks are drawn at y-scroll_y.
+    Tower blocks keep their x relative to tower_x, how far the tower has
+    moved, so they are drawn at x+tower_x and moving the tower costs the
+    same at any height. top_x is where the top block of the tower is.
+    '''
+    base_pos = (230,0)
+    start_pos = (230,520)
+    block_size = (40,60)
+
+    # the bottommost block is removed once the tower has max_blocks blocks,
+    # e.g. 5, 50 or 500, and the view scrolls up once the tower on screen
+    # is view_blocks tall, by default when the bottom block is removed
+    max_blocks = 5
+    view_blocks = None
+
+    # pixels per second
+    drop_speed = 450
+
+    # the game advances in fixed ticks of tick_interval seconds;
+    # move_towerSM steps every tower_ticks ticks and move_blockSM
+    # every block_ticks ticks
+    tick_interval = 0.02
+    tower_ticks = 1
+    block_ticks = 2
+
+    # longest dt that step simulates, so that a stalled frame
+    # does not make the game run a burst of catch-up ticks
+    max_step = 0.25
+
+    # both blocks oscillate with an oscillator of this class, starting
+    # with these coefficients; move_blockSM starts over for every block
+    # unless restart_block_oscillator is False
+    oscillator = oscillateSM
+    tower_coeff = 2
+    block_coeff = 4
+    restart_block_oscillator = True
+
+    def __init__(self):
+        self.colour_machine = colourSM()
+        self.colour_machine.start()
+        self.move_blockSM = self.oscillator()
+        self.move_towerSM = self.oscillator()
+        self.restart()
+
+    def new_block(self,x,y):
+        '''
+        Creates a block with the next colour from colour_machine.
+        '''
+        self.colour_machine.step()
+        return BlockState(x,y,self.colour_machine.state,self.block_size)
+
+    def restart(self):
+        '''
+        Reset tower and building block, SM and game variables.
+        '''
+        # colour_machine carries on between games, so a replay needs its state
+        self.start_colour = self.colour_machine.state
+        self.tower = deque([self.new_block(*self.base_pos)])
+        self.next_block = self.new_block(*self.start_pos)
+        self.move_blockSM.start()
+        self.move_towerSM.start()
+        self.move_blockSM.coeff = self.block_coeff
+        self.move_towerSM.coeff = self.tower_coeff
+
+        self.score = 0
+        self.speed = 1.0
+        self.drop,self.lose = (False,False)
+
+        # sum of all steps of move_towerSM, i.e. how far the tower has moved
+        self.tower_x = 0
+        # x of the top block, moved by the same steps as tower_x, so the
+        # landing is checked with the same floats as a block moving itself
+        self.top_x = self.base_pos[0]
+
+        # heights of all removed blocks, i.e. how far the view has scrolled up
+        self.scroll_y = 0
+
+        # ticks run so far and time left over for the next tick
+        self.ticks = 0
+        self.accumulator = 0
+        # presses after the end of the last tick, in seconds after it
+        self.pending_presses = []
+
+        # self.ticks at every press that started a drop, and how many
+        # microseconds before the end of that tick it was, for replays
+        self.presses = []
+        self.press_offsets = []
+
+    def press_space(self,offset=0):
+        '''
+        Starts dropping the building block unless the game is lost.
+        offset is how many seconds, up to a tick, before the end of the
+        last tick SPACE was pressed. The block starts as far into its fall
+        as it would have fallen since then, rounded to a microsecond.
+        Returns True if the block started dropping.
+        '''
+        if self.lose or self.drop:
+            return False
+        self.drop = True
+        offset = min(round(offset*1e6),round(self.tick_interval*1e6))
+        self.presses.append(self.ticks)
+        self.press_offsets.append(offset)
+        if offset:
+            self.next_block.y -= self.drop_speed*offset/1e6
+        return True
+
+    def step(self,dt,presses=()):
+        '''
+        Advances the game by dt seconds in fixed ticks.
+        Time that does not fill a whole tick is carried over to the next step,
+        so the game runs at the same speed at any frame rate.
+        presses are the times in seconds into dt at which SPACE was pressed,
+        in order. Each press starts the drop right after the tick it was
+        pressed in, with the block as far into its fall as the rest of that
+        tick takes, so when in a frame the key was pressed matters as much
+        as which frame. A press after the last tick of this step waits for
+        the next tick, in a later step. Presses later than the dt that is
+        simulated, after a stalled frame, count as pressed at its end.
+        Returns the result of the landing if the block landed, else None.
+        '''
+        dt = min(dt,self.max_step)
+        # time into dt at which the last tick ended, before any tick of this step
+        end = -self.accumulator
+        presses = ([end+press for press in self.pending_presses]
+                   +[min(press,dt) for press in presses])
+        self.accumulator += dt
+        result = None
+        while self.accumulator >= self.tick_interval:
+            self.accumulator -= self.tick_interval
+            end += self.tick_interval
+            landing = self.tick()
+            if landing is not None:
+                result = landing
+            while presses and presses[0] <= end:
+                self.press_space(end-presses.pop(0))
+        self.pending_presses = [press-end for press in presses]
+        return result
+
+    def tick(self):
+        '''
+        Advances the game by one tick of tick_interval seconds.
+        Returns the result of the landing if the block landed, else None.
+        '''
+        self.ticks += 1
+        if self.ticks % self.tower_ticks == 0:
+            self.move_tower()
+        if self.ticks % self.block_ticks == 0:
+            self.move_block()
+        result = self.drop_block(self.tick_interval)
+        self.check_tower()
+        return result
+
+    def fast_forward(self,ticks):
+        '''
+        Advances the game by ticks ticks, bit for bit as calling tick()
+        that many times would, e.g. to play back a replay. Only the
+        ticks in which a block lands are run by tick(); between them
+        the oscillators' steps are summed by np.cumsum, which adds
+        them in the same order as move_tower and move_block.
+        '''
+        end = self.ticks+ticks
+        while self.ticks < end:
+            span = end-self.ticks
+            if self.drop:
+                landing = self.landing_ticks()
+                if landing <= span:
+                    self.skip_ticks(landing-1)
+                    self.tick()
+                    continue
+            self.skip_ticks(span)
+
+    def landing_ticks(self):
+        '''
+        Returns the number of ticks until the dropping block lands,
+        counting the tick it lands in, with the falls of drop_block.
+        When the fall per tick is a whole number of pixels, as 9 px and
+        10 px are, every fall subtracts exactly, so the block is k ticks
+        down at current_y-k*fall and the landing tick is worked out at
+        once. Any other fall is followed tick by tick.
+        '''
+        top_towerblock = self.tower[-1]
+        landing_y = top_towerblock.y+top_towerblock.size[1]
+        fall = self.drop_speed*self.tick_interval
+        current_y = self.next_block.y
+        if fall.is_integer() and abs(current_y) < 2**52:
+            ticks = max(1,math.ceil((current_y-landing_y)/fall))
+            # the division may round, the products do not
+            while current_y-ticks*fall > landing_y:
+                ticks += 1
+            while ticks > 1 and current_y-(ticks-1)*fall <= landing_y:
+                ticks -= 1
+            return ticks
+        ticks = 1
+        while current_y-fall > landing_y:
+            current_y -= fall
+            ticks += 1
+        return ticks
+
+    def skip_ticks(self,ticks):
+        '''
+        Advances the game by ticks ticks in which no block lands,
+        so only the tower, the building block and the ticks move.
+        '''
+        if ticks <= 0:
+            return
+        start = self.ticks
+        self.ticks += ticks
+
+        # tower_x, top_x and the building block's x or, while it drops,
+        # its y, each followed by what every tick adds to it
+        positions = np.zeros((3,ticks+1))
+        positions[0,0] = self.tower_x
+        positions[1,0] = self.top_x
+        self.add_steps(positions[:2],start,self.tower_ticks,self.move_towerSM)
+        if self.drop:
+            positions[2,0] = self.next_block.y
+            positions[2,1:] = -self.drop_speed*self.tick_interval
+        else:
+            positions[2,0] = self.next_block.x
+            self.add_steps(positions[2],start,self.block_ticks,self.move_blockSM)
+        (self.tower_x,self.top_x,
+         block) = np.add.accumulate(positions,axis=1)[:,-1].tolist()
+        if self.drop:
+            self.next_block.y = block
+        else:
+            self.next_block.x = block
+        self.check_tower()
+
+    @staticmethod
+    def add_steps(positions,start,every,machine):
+        '''
+        Puts the steps of machine into positions after the ticks from
+        start that are a multiple of every, and advances machine past them.
+        '''
+        ticks = positions.shape[-1]-1
+        first = every-start%every
+        count = (start+ticks)//every-start//every
+        if count:
+            positions[...,first::every] = machine.step_many(count)
+
+    def move_tower(self):
+        '''
+        Oscillates the tower based on
+        the step size from move_towerSM.
+        '''
+        step_size = self.move_towerSM.step()
+        self.tower_x += step_size
+        self.top_x += step_size
+
+    def move_block(self):
+        '''
+        Oscillates the building block based on
+        the step size from move_blockSM.
+        '''
+        if self.drop == False:
+            step_size = self.move_blockSM.step()
+            self.next_block.x += step_size
+
+    def check_tower(self):
+        '''
+        Removes the bottommost block if the tower is max_blocks tall.
+        Scrolls the view up by a block once the tower on screen is
+        view_blocks tall, which moves the tower down on screen without
+        changing its blocks.
+        Returns the removed block, else None.
+        '''
+        removed = None
+        if len(self.tower) >= self.max_blocks:
+            removed = self.tower.popleft()
+
+        top = self.tower[-1]
+        height = top.size[1]
+        view_blocks = self.view_blocks or self.max_blocks
+        if top.y-self.scroll_y >= self.base_pos[1]+(view_blocks-1)*height:
+            self.scroll_y += height
+            # the building block stays at the same place on screen
+            self.next_block.y += height
+        return removed
+
+    def drop_block(self,dt):
+        '''
+        Drops the building block once the SPACEBAR is pressed.
+        The block lands in the tick in which it reaches the top of the
+        tower, instead of falling past it and landing a tick later.
+        Returns the result of the landing if the block landed, else None.
+        '''
+        if self.drop == False:
+            return None
+
+        current_y = self.next_block.y
+        top_towerblock = self.tower[-1]
+        landing_y = top_towerblock.y+top_towerblock.size[1]
+
+        if current_y-self.drop_speed*dt > landing_y:
+            # no impact within this tick
+            self.next_block.y = current_y-self.drop_speed*dt
+            return None
+
+        # stop dropping
+        self.next_block.y = landing_y
+        self.drop = False
+        return self.check_landing()
+
+    def check_landing(self):
+        '''
+        Checks the accuracy of the landing and updates score and speed.
+        Appends the building block to the tower and creates a new one.
+        Returns 'lose', 'Bad..', 'Good' or 'Great!'.
+        '''
+        top_block = self.tower[-1]
+        top_x = self.top_x
+        width = top_block.size[0]
+        x = self.next_block.x
+
+        # failed landing
+        if x<top_x-width or x>top_x+width:
+            self.lose = True
+            result = 'lose'
+
+        # successful landing
+        else:
+            self.score += 1
+            result = self.grade_landing(x,top_x,width)
+
+        # append next_block to the tower, relative to tower_x,
+        # and create a new building block
+        self.top_x = x
+        self.next_block.x = x-self.tower_x
+        self.tower.append(self.next_block)
+        if self.restart_block_oscillator:
+            self.move_blockSM.start()
+        self.next_block = self.new_block(self.start_pos[0],
+                                         self.start_pos[1]+self.scroll_y)
+        return result
+
+    def grade_landing(self,x,top_x,width):
+        '''
+        Changes the speed of the game after a block landed at x
+        on the top block at top_x. Returns 'Bad..', 'Good' or 'Great!'.
+        '''
+        # bad landing
+        if x<top_x-0.5*width or x>top_x+0.5*width:
+            result = 'Bad..'
+            if self.move_towerSM.coeff<=14:
+                self.move_towerSM.coeff *= 1.2
+                self.move_blockSM.coeff *= 1.2
+                self.speed += 0.2
+
+        # good landing
+        elif x<top_x-0.1*width or x>top_x+0.1*width:
+            result = 'Good'
+            if self.move_towerSM.coeff<=14:
+                self.move_towerSM.coeff *= 1.1
+                self.move_blockSM.coeff *= 1.1
+                self.speed += 0.1
+
+        # great landing
+        else:
+            result = 'Great!'
+            if self.move_towerSM.coeff>2:
+                self.speed -= 0.1
+                self.move_towerSM.coeff *= 0.9
+                self.move_blockSM.coeff *= 0.9
+        return result
@@ -0,0 +1,267 @@
+'''
+Tests of the StackEm engine: the oscillators against the original
+state machines, fast_forward against tick, replays, press timing of
+step, and BatchStackEm against StackEm.
+'''
+import random
+
+import numpy as np
+import pytest
+
+from batch_sim import RESULTS, BatchStackEm
+from replay import Replay
+from stackem_engine import SM, StackEm, oscillateSM
+from tournament import aim_bot
+
+
+class original_oscillateSM(SM):
+    '''
+    oscillateSM of kv_stackem.py before the lookup table.
+    '''
+    start_state = ['RIGHT', 0]
+    coeff = 0
+
+    def get_next_values(self, state):
+        unit = np.pi/2/20
+        direction = state[0]
+        pos = state[1]
+        step = self.coeff*np.cos(unit*pos)
+        if direction == 'RIGHT':
+            output = step
+            if pos < 20:
+                ns = ['RIGHT', state[1]+1]
+            else:
+                ns = ['LEFT', state[1]-1]
+        elif direction == 'LEFT':
+            output = -step
+            if pos > -20:
+                ns = ['LEFT', state[1]-1]
+            else:
+                ns = ['RIGHT', state[1]+1]
+        return ns, output
+
+
+class original_pgOscillateSM(SM):
+    '''
+    oscillateSM of pg_stackem.py before the lookup table.
+    '''
+    start_state = ['RIGHT', 0]
+    coeff = 1
+
+    def get_next_values(self, state):
+        x_norm = np.pi/2/10
+        unit = x_norm*state[1]
+        if state[0] == 'RIGHT':
+            if state[1] <= 10:
+                output = self.coeff*np.cos(unit)
+                ns = ['RIGHT', state[1]+1]
+            else:
+                output = 0
+                ns = ['LEFT', state[1]-1]
+        if state[0] == 'LEFT':
+            if state[1] >= -10:
+                output = -self.coeff*np.cos(unit)
+                ns = ['LEFT', state[1]-1]
+            else:
+                output = 0
+                ns = ['RIGHT', state[1]+1]
+        return ns, output
+
+
+def trajectory(machine, coeffs, steps=1000):
+    '''
+    Returns the x of a block moved by machine, changing coeff
+    to the next of coeffs every 50 steps as landings do.
+    '''
+    machine.start()
+    x = 230
+    xs = []
+    for i in range(steps):
+        machine.coeff = coeffs[i//50 % len(coeffs)]
+        x += machine.step()
+        xs.append(float(x).hex())
+    return xs
+
+
+def play(game, ticks, seed=0):
+    '''
+    Plays game for ticks ticks with aim_bot, pressing a random time into
+    each tick, and returns the presses as (tick, offset in seconds).
+    '''
+    rng = random.Random(seed)
+    presses = []
+    for t in range(ticks):
+        if not game.drop and aim_bot(game):
+            offset = rng.randrange(20000)/1e6
+            presses.append((game.ticks, offset))
+            game.press_space(offset)
+        game.tick()
+    return presses
+
+
+def state(game):
+    '''
+    Everything the rules and the renderers read, with floats as hex
+    so that they compare bit for bit.
+    '''
+    blocks = [(float(b.x).hex(), float(b.y).hex(), b.colour) for b in game.tower]
+    return (game.ticks, game.score, game.lose, game.drop, game.speed,
+            float(game.tower_x).hex(), float(game.top_x).hex(), game.scroll_y,
+            float(game.next_block.x).hex(), float(game.next_block.y).hex(),
+            game.next_block.colour, blocks,
+            game.move_towerSM.state, game.move_towerSM.coeff,
+            game.move_blockSM.state, game.move_blockSM.coeff)
+
+
+def test_oscillator_matches_the_original():
+    coeffs = (4, 4.4, 4.84, 4.356, 3.9204)
+    assert (trajectory(oscillateSM(), coeffs)
+            == trajectory(original_oscillateSM(), coeffs))
+
+
+def test_pg_oscillator_matches_the_original():
+    pg_stackem = pytest.importorskip('pg_stackem')
+    coeffs = (1, 2, 3, 2, 1, 0)
+    assert (trajectory(pg_stackem.pgOscillateSM(), coeffs)
+            == trajectory(original_pgOscillateSM(), coeffs))
+
+
+def test_step_many_matches_step():
+    machine = oscillateSM()
+    machine.start()
+    machine.coeff = 4
+    other = oscillateSM()
+    other.start()
+    other.coeff = 4
+    for count in (1, 7, 80, 81, 500):
+        steps = machine.step_many(count)
+        assert steps.tolist() == [other.step() for i in range(count)]
+        assert machine.state == other.state
+
+
+@pytest.mark.parametrize('game_class', ['StackEm', 'PgStackEm'])
+def test_fast_forward_matches_tick(game_class):
+    if game_class == 'PgStackEm':
+        game_class = pytest.importorskip('pg_stackem').PgStackEm
+    else:
+        game_class = StackEm
+    game = game_class()
+    presses = play(game, 20000)
+    assert game.score > 10
+
+    forward = game_class()
+    for tick, offset in presses:
+        forward.fast_forward(tick-forward.ticks)
+        forward.press_space(offset)
+    forward.fast_forward(game.ticks-forward.ticks)
+    assert state(forward) == state(game)
+    assert forward.presses == game.presses
+    assert forward.press_offsets == game.press_offsets
+
+
+def test_replay_round_trip_and_verify():
+    game = StackEm()
+    play(game, 20000)
+    replay = Replay.record(game)
+    loaded = Replay.from_bytes(replay.to_bytes())
+    assert loaded.__dict__ == replay.__dict__
+    assert loaded.verify()
+    assert state(loaded.play()) == state(game)
+
+
+def test_replay_with_other_score_or_settings_fails_verify():
+    game = StackEm()
+    play(game, 5000)
+    replay = Replay.from_bytes(Replay.record(game).to_bytes())
+    replay.score += 1
+    assert not replay.verify()
+
+    # a still tower makes every landing easy
+    replay = Replay.from_bytes(Replay.record(game).to_bytes())
+    replay.settings['tower_coeff'] = 0
+    replay.score = replay.play().score
+    assert not replay.verify()
+
+
+def test_record_refuses_other_rules():
+    pg_stackem = pytest.importorskip('pg_stackem')
+    with pytest.raises(ValueError):
+        Replay.record(pg_stackem.PgStackEm())
+
+
+def test_press_starts_the_drop_after_its_tick():
+    game = StackEm()
+    y = game.next_block.y
+    # 7 ms before the end of the first tick
+    game.step(0.05, [0.013])
+    assert game.ticks == 2
+    assert game.presses == [1]
+    assert game.press_offsets == [7000]
+    # 7 ms of the first tick and all of the second
+    fall = game.drop_speed*0.007+game.drop_speed*game.tick_interval
+    assert game.next_block.y == pytest.approx(y-fall)
+
+
+def test_press_after_the_last_tick_waits_for_the_next():
+    game = StackEm()
+    game.step(0.03, [0.025])
+    assert not game.drop
+    assert game.pending_presses == [pytest.approx(0.005)]
+    game.step(0.02)
+    assert game.presses == [2]
+    assert game.press_offsets == [15000]
+    assert game.pending_presses == []
+
+
+def test_press_late_in_a_stalled_frame_counts_at_its_end():
+    game = StackEm()
+    game.step(1.0, [0.9])
+    assert game.ticks == 12
+    # max_step is 12.5 ticks, so the press is half a tick after the last one
+    assert game.pending_presses == [pytest.approx(0.01)]
+    game.step(game.tick_interval)
+    assert game.presses == [13]
+    assert game.press_offsets == [10000]
+
+
+def test_press_offsets_are_at_most_a_tick():
+    game = StackEm()
+    assert game.press_space(1.0)
+    assert game.press_offsets == [20000]
+    assert not game.press_space()
+
+
+def test_batch_matches_stackem():
+    # aim_bot with different delays reaches every kind of landing
+    games = [StackEm() for i in range(12)]
+    delays = [i % 4 for i in range(len(games))]
+    press_at = [None]*len(games)
+    batch = BatchStackEm(len(games))
+    for t in range(6000):
+        mask = np.zeros(len(games), dtype=bool)
+        for i, game in enumerate(games):
+            if press_at[i] is None and not game.drop and aim_bot(game):
+                press_at[i] = game.ticks+delays[i]
+            if press_at[i] == game.ticks:
+                mask[i] = game.press_space()
+                press_at[i] = None
+        assert (batch.press_space(mask) == mask).all()
+        batch.tick()
+        for i, game in enumerate(games):
+            assert RESULTS[batch.result[i]] == game.tick()
+
+    for i, game in enumerate(games):
+        assert (game.score, game.lose, len(game.tower)) == \
+            (batch.score[i], batch.lose[i], batch.height[i])
+        assert (game.speed, game.move_towerSM.coeff, game.move_blockSM.coeff) == \
+            (batch.speed[i], batch.tower_coeff[i], batch.block_coeff[i])
+        # BatchStackEm keeps the building block's y on screen
+        assert (game.top_x, game.next_block.x, game.next_block.y-game.scroll_y) == \
+            (batch.top_x[i], batch.next_x[i], batch.next_y[i])
+    assert len({game.score for game in games}) > 1
+
+
+def test_batch_rejects_other_rules():
+    pg_stackem = pytest.importorskip('pg_stackem')
+    with pytest.raises(ValueError):
+        BatchStackEm(2, pg_stackem.PgStackEm)
@@ -0,0 +1,200 @@
+'''
+Tests of the highscore log: migration of the old format, partial lines
+left by a crash, and compaction with other writers; and of the
+HighscoreWorker when the log cannot be loaded, a callback fails or its
+queue is full.
+'''
+import locale
+import multiprocessing
+import os
+
+from highscores import HEADER, HighscoreStore, HighscoreWorker
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_new_log_has_header(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    store = HighscoreStore(path)
+    assert len(store) == 0
+    assert read(path) == HEADER
+
+
+def test_legacy_file_is_migrated(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    with open(path, 'w') as f:
+        # the old format kept the latest score of every name
+        f.write('alice,5\nbob,7\nalice,3\n')
+    store = HighscoreStore(path)
+    assert store.get('alice') == 3
+    assert store.top(2) == [('bob', 7), ('alice', 3)]
+    assert read(path) == HEADER+'alice,3\nbob,7\n'
+    assert HighscoreStore(path).scores == store.scores
+
+
+def test_legacy_file_in_the_locale_encoding_is_migrated(tmp_path, monkeypatch):
+    path = str(tmp_path/'highscores.txt')
+    with open(path, 'wb') as f:
+        f.write('zoë,5\nbob,7\n'.encode('cp1252'))
+    monkeypatch.setattr(locale, 'getpreferredencoding', lambda do_setlocale=True: 'cp1252')
+    store = HighscoreStore(path)
+    assert store.top(2) == [('bob', 7), ('zoë', 5)]
+    # the migrated log is UTF-8
+    assert read(path) == HEADER+'zoë,5\nbob,7\n'
+
+
+def test_partial_last_line_is_dropped(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    with open(path, 'w') as f:
+        f.write(HEADER+'alice,5\nbob,1')
+    store = HighscoreStore(path)
+    assert store.scores == {'alice': 5}
+    assert read(path) == HEADER+'alice,5\n'
+    store.upsert('carol', 2)
+    assert HighscoreStore(path).scores == {'alice': 5, 'carol': 2}
+
+
+def test_refresh_waits_for_the_end_of_a_line(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    store = HighscoreStore(path)
+    with open(path, 'a') as f:
+        f.write('alice,')
+    assert not store.refresh()
+    with open(path, 'a') as f:
+        f.write('5\n')
+    assert store.refresh()
+    assert store.get('alice') == 5
+
+
+def test_upsert_reads_other_writers_first(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    a = HighscoreStore(path)
+    b = HighscoreStore(path)
+    assert b.upsert('tourney', 999)
+    assert not a.upsert('tourney', 500)
+    assert a.upsert('player', 1)
+    assert a.get('tourney') == 999
+    assert HighscoreStore(path).scores == {'tourney': 999, 'player': 1}
+
+
+def test_compaction_keeps_other_writers_scores(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    a = HighscoreStore(path)
+    b = HighscoreStore(path)
+    b.upsert('tourney', 999)
+    for score in range(1, 10):
+        a.upsert('player', score)
+    # a compacted at least once
+    assert read(path).count('player,') == 1
+    assert HighscoreStore(path).scores == {'tourney': 999, 'player': 9}
+    # b reads the compacted log and appends after it
+    b.upsert('bot', 3)
+    assert HighscoreStore(path).scores == {'tourney': 999, 'player': 9, 'bot': 3}
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+
+def test_refresh_reloads_a_log_replaced_after_its_stat(tmp_path, monkeypatch):
+    path = str(tmp_path/'highscores.txt')
+    with open(path, 'w') as f:
+        f.write(HEADER+'alice,1\nalice,5\n')
+    a = HighscoreStore(path)
+    before = os.stat(path)
+    b = HighscoreStore(path)
+    b.upsert('bobbybobby', 7)
+    # the old offset of a is in the middle of the line 'bobbybobby,7'
+    b.compact()
+    # a compaction lands between the stat of refresh and its open:
+    # the stat still shows the old log, grown by a line
+    stat = os.stat
+    def old_stat(p, *args, **kwargs):
+        result = stat(p, *args, **kwargs)
+        if p == path:
+            return os.stat_result((result.st_mode, before.st_ino)+tuple(result)[2:6]
+                                  +(before.st_size+8,)+tuple(result)[7:])
+        return result
+    monkeypatch.setattr(os, 'stat', old_stat)
+    assert a.refresh()
+    assert a.scores == {'alice': 5, 'bobbybobby': 7}
+
+
+def save_scores(path, name, count, barrier):
+    store = HighscoreStore(path)
+    barrier.wait()
+    # a new best score every time, so the processes compact the log
+    for score in range(1, count+1):
+        store.upsert(name, score)
+        if score%10 == 0:
+            store.upsert('{}-{}'.format(name, score), score)
+
+
+def test_processes_share_a_log(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    HighscoreStore(path)
+    names = ['p{}'.format(i) for i in range(4)]
+    # all processes save at the same time
+    barrier = multiprocessing.Barrier(len(names))
+    processes = [multiprocessing.Process(target=save_scores, args=(path, name, 50, barrier))
+                 for name in names]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    scores = HighscoreStore(path).scores
+    assert len(scores) == 4*6
+    assert all(scores[name] == 50 for name in names)
+
+
+def test_worker_reports_a_log_it_cannot_load(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    with open(path, 'wb') as f:
+        # a log is UTF-8, so this one is corrupt
+        f.write(HEADER.encode()+'zoë,5\n'.encode('latin-1'))
+    errors = []
+    worker = HighscoreWorker(path, on_error=errors.append)
+    worker.start()
+    worker.thread.join()
+    assert isinstance(errors[0], UnicodeDecodeError)
+    assert worker.error is errors[0]
+    # saves are dropped instead of waiting for a worker that stopped
+    for i in range(2*worker.max_pending):
+        assert not worker.save('player{}'.format(i), i)
+    worker.close()
+
+
+def test_worker_reports_a_failed_callback_and_carries_on(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    boards = []
+    errors = []
+    called = []
+    def fail():
+        raise OSError('disk full')
+    worker = HighscoreWorker(path, on_leaderboard=boards.append, on_error=errors.append)
+    # both saves are queued before the thread starts, so they are written together
+    assert worker.save('a', 5, fail)
+    assert worker.save('b', 3, lambda: called.append('b'))
+    worker.start()
+    worker.close()
+    assert called == ['b']
+    assert [str(error) for error in errors] == ['disk full']
+    assert boards[-1] == [('a', 5), ('b', 3)]
+
+
+def test_worker_drops_saves_when_the_queue_is_full(tmp_path):
+    path = str(tmp_path/'highscores.txt')
+    boards = []
+    worker = HighscoreWorker(path, on_leaderboard=boards.append)
+    worker.max_pending = 2
+    # the thread is not started yet, so nothing leaves the queue
+    assert worker.save('a', 1)
+    assert worker.save('b', 1)
+    assert not worker.save('c', 1)
+    # saves of a queued player are coalesced
+    assert worker.save('a', 5)
+    worker.start()
+    worker.close()
+    assert boards[-1] == [('a', 5), ('b', 1)]
+    assert not worker.save('a', 6)
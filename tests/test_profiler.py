@@ -0,0 +1,76 @@
+'''
+Tests of the Profiler: percentiles over the window, timing only the
+instrumented game, the CSV and JSON dumps, and DropLatency.
+'''
+import csv
+import json
+
+import pytest
+
+from profiler import CALLBACKS, DropLatency, Profiler, Timer
+from stackem_engine import StackEm
+
+
+def test_timer_percentiles_are_over_the_window():
+    timer = Timer(window=100)
+    for ns in range(1, 201):
+        timer.add(ns*1000)
+    # the window holds 101..200 us, count, mean and max every call
+    assert timer.percentiles() == [151000, 196000, 200000]
+    summary = timer.summary()
+    assert summary['count'] == 200
+    assert summary['mean_us'] == 100.5
+    assert summary['max_us'] == 200
+    assert Timer().percentiles() == [0, 0, 0]
+
+
+def test_instrument_times_only_that_game():
+    profiler = Profiler()
+    game = profiler.instrument(StackEm())
+    other = StackEm()
+    for t in range(200):
+        if t % 50 == 0:
+            game.press_space()
+            other.press_space()
+        game.tick()
+        other.tick()
+    assert profiler.timer('move_tower').count == 200
+    assert profiler.timer('check_landing').count == game.score+game.lose > 0
+    assert set(profiler.timers) == set(CALLBACKS)
+    # the other game runs its own methods
+    assert 'move_tower' not in vars(other)
+    assert (other.score, other.tower_x) == (game.score, game.tower_x)
+
+
+def test_dump_csv_and_json(tmp_path):
+    profiler = Profiler()
+    profiler.add('frame', 16000000)
+    profiler.add('frame', 17000000)
+    profiler.add('update', 50000)
+
+    path = str(tmp_path/'profile.json')
+    profiler.dump(path)
+    with open(path) as f:
+        assert json.load(f) == profiler.summary()
+
+    path = str(tmp_path/'profile.csv')
+    profiler.dump(path)
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['name'] for row in rows] == ['frame', 'update']
+    assert float(rows[0]['max_us']) == 17000
+
+
+def test_drop_latency_is_timed_to_the_first_frame_that_moves():
+    profiler = Profiler()
+    latency = DropLatency(profiler)
+    game = StackEm()
+    # the press arrives 5 ms into a frame that ends before the next tick
+    latency.before(game, [1.005])
+    game.step(0.01, [0.005])
+    latency.after(game, 1.010)
+    assert profiler.timer('input.latency').count == 0
+    latency.before(game, [])
+    game.step(0.02)
+    latency.after(game, 1.030)
+    assert profiler.timer('input.latency').samples[0] == pytest.approx(25000000)
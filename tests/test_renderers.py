@@ -0,0 +1,166 @@
+'''
+Tests of the Kivy renderers of kv_stackem.py against the engine's screen
+positions. Kivy's graphics instructions need a GL context, so they are
+replaced by plain objects that only keep their attributes and children.
+'''
+import os
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+kv_stackem = pytest.importorskip('kv_stackem')
+
+from stackem_engine import StackEm
+from tournament import aim_bot
+
+INSTRUCTIONS = ('Rectangle', 'Color', 'InstructionGroup', 'Translate',
+                'PushMatrix', 'PopMatrix', 'Mesh', 'RenderContext')
+COLOURS = {rgba: name for name, rgba in kv_stackem.Block.colours.items()}
+
+
+class Instruction:
+    '''
+    Stands in for every instruction the renderers create.
+    '''
+    def __init__(self, *args, **kwargs):
+        self.children = []
+        self.x = self.y = 0
+        self.shader = self
+        self.__dict__.update(kwargs)
+
+    def add(self, child):
+        self.children.append(child)
+
+    def remove(self, child):
+        self.children.remove(child)
+
+    def clear(self):
+        self.children.clear()
+
+    @property
+    def xy(self):
+        return (self.x, self.y)
+
+    @xy.setter
+    def xy(self, xy):
+        self.x, self.y = xy
+
+
+@pytest.fixture(autouse=True)
+def instructions(monkeypatch):
+    for name in INSTRUCTIONS:
+        monkeypatch.setattr(kv_stackem, name, Instruction)
+
+
+def screen(game):
+    '''
+    Returns (x, y, colour) on screen of the tower blocks
+    and of the building block.
+    '''
+    tower = [(b.x+game.tower_x, b.y-game.scroll_y, b.colour) for b in game.tower]
+    block = game.next_block
+    return tower, (block.x, block.y-game.scroll_y, block.colour)
+
+
+def drawn_blocks(renderer):
+    x, y = renderer.tower_translate.xy
+    tower = [(b.shape.pos[0]+x, b.shape.pos[1]+y, b.state.colour) for b in renderer.tower]
+    block = renderer.next_block
+    return tower, (block.shape.pos[0], block.shape.pos[1], block.state.colour)
+
+
+def drawn_mesh(renderer):
+    x, y = renderer.tower_translate.xy
+    v = renderer.vertices
+    tower = [(v[s, 0, 0]+x, v[s, 0, 1]+y, COLOURS[tuple(v[s, 0, 2:].tolist())])
+             for s in renderer.slots]
+    v = renderer.next_vertices
+    return tower, (v[0, 0], v[0, 1], COLOURS[tuple(v[0, 2:].tolist())])
+
+
+def assert_drawn(renderer, game):
+    if isinstance(renderer, kv_stackem.MeshRenderer):
+        tower, block = drawn_mesh(renderer)
+        # the vertices are float32
+        tolerance = 1e-2
+        for slot in set(range(renderer.capacity))-set(renderer.slots):
+            assert np.ptp(renderer.vertices[slot, :, :2], axis=0).tolist() == [0, 0]
+    else:
+        tower, block = drawn_blocks(renderer)
+        tolerance = 1e-9
+    expected, expected_block = screen(game)
+    assert len(tower) == len(expected)
+    for (x, y, colour), (ex, ey, ecolour) in zip(tower+[block], expected+[expected_block]):
+        assert x == pytest.approx(ex, abs=tolerance)
+        assert y == pytest.approx(ey, abs=tolerance)
+        assert colour == ecolour
+
+
+def play(renderer, game, ticks, restart_at=None):
+    '''
+    Plays game with aim_bot, drawing every tick as GameWidget.update does,
+    and checks the drawing whenever the scroll animation is not running.
+    '''
+    for t in range(ticks):
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        result = game.step(game.tick_interval)
+        renderer.view.step(game.tick_interval)
+        renderer.move_tower()
+        renderer.move_block()
+        if result is not None:
+            renderer.land()
+        if renderer.view.y == game.scroll_y and t % 50 == 0:
+            assert_drawn(renderer, game)
+        if t == restart_at:
+            game.restart()
+            renderer.draw_blocks()
+            assert_drawn(renderer, game)
+
+
+@pytest.mark.parametrize('max_blocks', [5, 50])
+@pytest.mark.parametrize('renderer_class', ['BlockRenderer', 'MeshRenderer'])
+def test_renderer_draws_the_game(renderer_class, max_blocks):
+    game = StackEm()
+    game.max_blocks = max_blocks
+    game.view_blocks = 5
+    renderer = getattr(kv_stackem, renderer_class)(Instruction(), game)
+    play(renderer, game, 20000, restart_at=10000)
+    assert game.score > max_blocks
+    assert_drawn(renderer, game)
+
+
+def test_block_pool_stops_creating_blocks():
+    game = StackEm()
+    renderer = kv_stackem.BlockRenderer(Instruction(), game)
+    play(renderer, game, 10000, restart_at=5000)
+    assert game.score > 50
+    # the tower cap, the building block and a block scrolling off
+    assert renderer.pool.created <= game.max_blocks+2
+    assert renderer.pool.reused > 50
+
+
+@pytest.mark.parametrize('renderer_class', ['BlockRenderer', 'MeshRenderer'])
+def test_removed_block_is_drawn_until_scrolled_off(renderer_class):
+    game = StackEm()
+    renderer = getattr(kv_stackem, renderer_class)(Instruction(), game)
+    # land blocks without moving the view until the bottom one is removed
+    while game.scroll_y == 0:
+        if not game.drop and aim_bot(game):
+            game.press_space()
+        if game.tick() is not None:
+            renderer.land()
+    assert not game.lose
+    # check_tower removed the bottom block, but the view has not moved yet
+    assert len(renderer.removed) == 1
+    renderer.move_tower()
+    assert len(renderer.removed) == 1
+
+    renderer.view.step(renderer.view.duration)
+    renderer.move_tower()
+    assert len(renderer.removed) == 0
+    assert_drawn(renderer, game)
+    if renderer_class == 'BlockRenderer':
+        assert len(renderer.tower_group.children) == len(game.tower)
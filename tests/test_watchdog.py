@@ -0,0 +1,46 @@
+'''
+Tests of the MemoryWatch: growth of a steady and a leaking counter,
+peaks and limits, and counting nested instructions.
+'''
+from watchdog import MemoryWatch, count_instructions
+
+
+class Group:
+    def __init__(self, *children):
+        self.children = list(children)
+
+
+class Leaf:
+    pass
+
+
+def test_growth_is_the_slope_per_minute():
+    items = []
+    watch = MemoryWatch({'items': lambda: len(items),
+                         'level': lambda: 5+len(items) % 2}, window=10)
+    watch.start()
+    try:
+        for second in range(30):
+            items.extend(range(3))
+            watch.sample(second)
+    finally:
+        watch.stop()
+    growth = watch.growth()
+    # 3 items a second
+    assert round(growth['items']) == 180
+    # going up and down is not growth
+    assert abs(growth['level']) < 10
+    assert watch.last()['items'] == 90
+    assert watch.peaks['level'] == 6
+    assert watch.outside({'items': 100, 'level': 5}) == ['level']
+
+
+def test_growth_needs_two_samples():
+    watch = MemoryWatch({}, window=4)
+    assert watch.growth() == {}
+    assert watch.text() == ''
+
+
+def test_count_instructions_counts_nested_groups():
+    group = Group(Leaf(), Group(Leaf(), Leaf()), Group())
+    assert count_instructions(group) == 5
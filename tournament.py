@@ -0,0 +1,171 @@
+'''
+Tournament of Stack 'Em! bot policies, played without any window.
+
+A policy is a callable that is given a StackEm object between ticks and
+returns True to press SPACE. It can read the building block and the top
+of the tower, which is what StackEm.check_landing compares.
+
+The games themselves have no randomness, so every game gets a reaction
+delay drawn from its own seed: a press the policy asks for happens a
+random number of ticks later, like a human player's. Games are played in
+chunks across a ProcessPoolExecutor, and each chunk sends back only its
+scores and tick count.
+
+Run from the repository root:
+    python tournament.py aim eager --games 5000 --highscores highscores.txt
+'''
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from highscores import HighscoreStore
+from stackem_engine import StackEm
+
+# sums of the steps of each oscillator class over two cycles, so that the
+# tower's movement over its next k steps from state s is prefix[s+k]-prefix[s]
+PREFIXES = {}
+
+
+def prefix_sums(machine):
+    '''
+    Returns the sums of the steps of machine's class over two cycles.
+    '''
+    prefix = PREFIXES.get(type(machine))
+    if prefix is None:
+        prefix = [0.0]
+        for step in machine.steps*2:
+            prefix.append(prefix[-1]+step)
+        PREFIXES[type(machine)] = prefix
+    return prefix
+
+def aim_bot(game):
+    '''
+    Returns True when a drop started now would land within a tenth of
+    the block width of the top of the tower.
+    '''
+    top = game.tower[-1]
+    landing_y = top.y+top.size[1]
+    fall = game.drop_speed*game.tick_interval
+    # the block lands in the tick it reaches landing_y
+    ticks = -int(-(game.next_block.y-landing_y)//fall)
+    # the tower steps in the ticks of the drop that are a multiple of tower_ticks
+    steps = (game.ticks+ticks)//game.tower_ticks-game.ticks//game.tower_ticks
+    machine = game.move_towerSM
+    prefix = prefix_sums(machine)
+    shift = machine.coeff*(prefix[machine.state+steps]-prefix[machine.state])
+    return abs(game.next_block.x-(game.top_x+shift)) < 0.1*top.size[0]
+
+def eager_bot(game):
+    '''
+    Returns True when the building block is above the top of the tower
+    right now, without allowing for the tower moving during the drop.
+    '''
+    top = game.tower[-1]
+    return abs(game.next_block.x-game.top_x) < 0.1*top.size[0]
+
+# policies that can be named on the command line
+POLICIES = {'aim':aim_bot,'eager':eager_bot}
+
+
+def play_game(policy,seed,jitter=3,max_ticks=30000):
+    '''
+    Plays one game until it is lost or max_ticks have passed.
+    Presses happen 0 to jitter ticks after the policy asks for them.
+    Returns the score and the number of ticks played.
+    '''
+    rng = random.Random(seed)
+    game = StackEm()
+    press_at = None
+    while not game.lose and game.ticks < max_ticks:
+        if press_at is None:
+            if not game.drop and policy(game):
+                press_at = game.ticks+rng.randint(0,jitter)
+        if press_at == game.ticks:
+            game.press_space()
+            press_at = None
+        game.tick()
+    return game.score,game.ticks
+
+def play_chunk(name,seeds,jitter,max_ticks):
+    '''
+    Plays one game per seed with the policy called name.
+    Returns the scores as an array and the total number of ticks,
+    so a worker sends back one small message per chunk.
+    '''
+    policy = POLICIES[name]
+    scores = np.empty(len(seeds),dtype=np.int64)
+    total_ticks = 0
+    for i,seed in enumerate(seeds):
+        scores[i],ticks = play_game(policy,seed,jitter,max_ticks)
+        total_ticks += ticks
+    return scores,total_ticks
+
+
+def run(names,games=1000,workers=None,chunk=None,jitter=3,max_ticks=30000,seed=0):
+    '''
+    Plays games games with every policy in names.
+    Returns {name: (scores, ticks, seconds)}.
+    '''
+    workers = workers or os.cpu_count()
+    chunk = chunk or max(1,games//(workers*4))
+    results = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for name in names:
+            start = time.perf_counter()
+            futures = [pool.submit(play_chunk,name,range(seed+i,seed+min(i+chunk,games)),
+                                   jitter,max_ticks)
+                       for i in range(0,games,chunk)]
+            parts = [future.result() for future in futures]
+            seconds = time.perf_counter()-start
+            scores = np.concatenate([scores for scores,ticks in parts])
+            results[name] = (scores,sum(ticks for scores,ticks in parts),seconds)
+    return results
+
+def report(results):
+    print('{:<8}{:>8}{:>8}{:>7}{:>7}{:>7}{:>7}{:>10}{:>13}'.format(
+        'policy','games','mean','p10','p50','p90','max','games/s','ticks/s'))
+    for name,(scores,ticks,seconds) in results.items():
+        p10,p50,p90 = np.percentile(scores,(10,50,90))
+        print('{:<8}{:>8,}{:>8.1f}{:>7.0f}{:>7.0f}{:>7.0f}{:>7,}{:>10,.0f}{:>13,.0f}'.format(
+            name,len(scores),scores.mean(),p10,p50,p90,scores.max(),
+            len(scores)/seconds,ticks/seconds))
+
+def save(results,path):
+    '''
+    Records the best score of every policy in the highscore log,
+    under the name 'bot:<policy>'.
+    '''
+    store = HighscoreStore(path)
+    for name,(scores,ticks,seconds) in results.items():
+        store.upsert('bot:'+name,int(scores.max()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play bot policies against each other.')
+    parser.add_argument('policies',nargs='*',default=list(POLICIES),
+                        help='policies to play: {}'.format(', '.join(POLICIES)))
+    parser.add_argument('--games',type=int,default=1000,help='games per policy')
+    parser.add_argument('--workers',type=int,help='processes, default: one per core')
+    parser.add_argument('--chunk',type=int,help='games per task sent to a process')
+    parser.add_argument('--jitter',type=int,default=3,help='most ticks a press is late')
+    parser.add_argument('--max-ticks',type=int,default=30000,help='ticks before a game ends')
+    parser.add_argument('--seed',type=int,default=0,help='seed of the first game')
+    parser.add_argument('--highscores',help='highscore log to record the best scores in')
+    args = parser.parse_args()
+    for name in args.policies:
+        if name not in POLICIES:
+            parser.error('unknown policy {!r}'.format(name))
+
+    results = run(args.policies,args.games,args.workers,args.chunk,
+                  args.jitter,args.max_ticks,args.seed)
+    report(results)
+    if args.highscores:
+        save(results,args.highscores)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+'''
+Opt-in watch on the memory of a long Stack 'Em! session.
+
+MemoryWatch samples the memory traced by tracemalloc and any number of
+counters, e.g. the number of instructions in each canvas group, and
+reports how fast each of them grows. A session that reuses its objects
+levels off; one that appends to a list every frame grows at a steady
+rate, however small each frame's share is.
+
+tracemalloc slows Python down while it traces, so the watch is only
+started on request.
+'''
+import tracemalloc
+from array import array
+
+
+def count_instructions(group):
+    '''
+    Returns the number of instructions in a Kivy InstructionGroup,
+    counting the instructions of nested groups as well.
+    '''
+    count = 0
+    for child in group.children:
+        count += 1
+        if hasattr(child,'children'):
+            count += count_instructions(child)
+    return count
+
+
+class MemoryWatch:
+    '''
+    The last window samples of the traced bytes, as 'memory', and of
+    every counter. counters maps names to functions that return a number.
+    The samples are kept in arrays allocated up front, so that sampling
+    does not grow the memory it measures.
+    '''
+    def __init__(self,counters,window=10):
+        self.counters = counters
+        self.window = window
+        self.names = ['memory']+list(counters)
+        self.times = array('d',bytes(8*window))
+        self.values = {name:array('d',bytes(8*window)) for name in self.names}
+        self.peaks = dict.fromkeys(self.names,0)
+        self.count = 0
+        self.tracing = False
+
+    def start(self):
+        '''
+        Starts tracemalloc unless something else already traces.
+        '''
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def sample(self,now):
+        '''
+        Records the memory and every counter at now seconds.
+        '''
+        i = self.count%self.window
+        self.times[i] = now
+        self.record('memory',i,tracemalloc.get_traced_memory()[0])
+        for name,counter in self.counters.items():
+            self.record(name,i,counter())
+        self.count += 1
+
+    def record(self,name,i,value):
+        self.values[name][i] = value
+        if value > self.peaks[name]:
+            self.peaks[name] = value
+
+    def last(self):
+        '''
+        Returns {name: value} of the newest sample.
+        '''
+        i = (self.count-1)%self.window
+        return {name:self.values[name][i] for name in self.names}
+
+    def growth(self):
+        '''
+        Returns {name: growth per minute} of the samples in the window,
+        as the slope of a least-squares line, so that a value going up and
+        down with the game does not look like growth.
+        '''
+        n = min(self.count,self.window)
+        if n < 2:
+            return {}
+        times = [t/60 for t in self.times[:n]]
+        mean_time = sum(times)/n
+        spread = sum((t-mean_time)**2 for t in times)
+        growth = {}
+        for name in self.names:
+            values = self.values[name][:n]
+            mean = sum(values)/n
+            growth[name] = sum((t-mean_time)*(v-mean) for t,v in zip(times,values))/spread
+        return growth
+
+    def outside(self,limits):
+        '''
+        Returns the names whose peak is above its limit in limits.
+        '''
+        return [name for name,limit in limits.items() if self.peaks[name] > limit]
+
+    def text(self):
+        '''
+        Returns a line of the last value, peak and growth per minute
+        for memory and for every counter.
+        '''
+        if not self.count:
+            return ''
+        last = self.last()
+        growth = self.growth()
+        lines = ['{:<16}{:>12}{:>12}{:>12}'.format('','last','peak','per min')]
+        for name in self.names:
+            lines.append('{:<16}{:>12,.0f}{:>12,.0f}{:>+12,.1f}'.format(
+                name,last[name],self.peaks[name],growth.get(name,0)))
+        return '\n'.join(lines)